@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+from agents.catalog import catalog
+from agents.registry import registry
+from agents.runtime import run_assistant
+from database import get_cached_response, store_cached_response, run_in_db
+from metrics import AGENT_CACHE_LOOKUPS
+
+# Set AGENT_CACHE=0 to always call OpenAI
+CACHE_ENABLED = os.getenv("AGENT_CACHE", "1") == "1"
+CACHE_TTL_SECONDS = int(os.getenv("AGENT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("AGENT_CACHE_MAX_ENTRIES", "5000"))
+
+# Since startup; sent to the dashboard with every processed post
+cache_stats = {"hits": 0, "misses": 0, "bypassed": 0}
+
+def _sha256(value):
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+def _content_hashes(content):
+    """Hash the text parts and the image parts of a message separately."""
+    texts, images = [], []
+    for part in content:
+        if part["type"] == "text":
+            texts.append(part["text"])
+        elif part["type"] == "image_url":
+            images.append(part["image_url"]["url"])
+        elif part["type"] == "image_file":
+            images.append(part["image_file"]["file_id"])
+    return _sha256("\n".join(texts)), _sha256("\n".join(images))
+
+async def cache_key(assistant_id, content, instructions=None):
+    """
+    Key for one agent invocation: the agent, the prompt version (effective instructions and
+    model), the attached vector stores and their content versions, and hashes of the input
+    text and images. Changing any of them, e.g. updating a prompt or uploading a knowledge
+    file, produces a new key rather than a stale hit.
+    """
+    assistant = await registry.get(assistant_id)
+    prompt_version = _sha256(f"{assistant.model}\n{instructions or assistant.instructions or ''}")
+    vector_stores = [[vector_store_id, await catalog.version(vector_store_id)] for vector_store_id in sorted(await registry.get_vector_store_ids(assistant_id))]
+    text_hash, image_hash = _content_hashes(content)
+    return _sha256(json.dumps([assistant_id, prompt_version, vector_stores, text_hash, image_hash]))
+
+def get_cache_stats():
+    """Hit/miss counts plus the hit rate, for the dashboard."""
+    lookups = cache_stats["hits"] + cache_stats["misses"]
+    return {**cache_stats, "hit_rate": round(cache_stats["hits"] / lookups, 3) if lookups else None}
+
+async def run_assistant_cached(assistant_id, content, label="Agent", on_delta=None, instructions=None, use_cache=True):
+    """
+    run_assistant with a persistent response cache in front of it.
+
+    An identical earlier invocation is answered from SQLite (passed to `on_delta` in one
+    piece), otherwise the assistant runs and its reply is stored. Entries expire after
+    AGENT_CACHE_TTL_SECONDS and the least recently used are evicted beyond
+    AGENT_CACHE_MAX_ENTRIES. `use_cache=False` bypasses the lookup but still refreshes the entry.
+    """
+    if not CACHE_ENABLED:
+        return await run_assistant(assistant_id, content, label=label, on_delta=on_delta, instructions=instructions)
+
+    key = await cache_key(assistant_id, content, instructions)
+    if use_cache:
+        cached = await run_in_db(get_cached_response, key, CACHE_TTL_SECONDS)
+        if cached is not None:
+            cache_stats["hits"] += 1
+            AGENT_CACHE_LOOKUPS.inc(result="hit", agent=label)
+            print(f"Cache hit ({label})")
+            if on_delta:
+                await on_delta(cached)
+            return cached
+        cache_stats["misses"] += 1
+        AGENT_CACHE_LOOKUPS.inc(result="miss", agent=label)
+    else:
+        cache_stats["bypassed"] += 1
+        AGENT_CACHE_LOOKUPS.inc(result="bypass", agent=label)
+
+    feedback = await run_assistant(assistant_id, content, label=label, on_delta=on_delta, instructions=instructions)
+    await run_in_db(store_cached_response, key, label, feedback, CACHE_MAX_ENTRIES)
+    return feedback
@@ -0,0 +1,89 @@
+import asyncio
+import os
+from agents.runtime import get_client
+from database import run_in_db, load_vector_store_files, load_vector_store_version, replace_vector_store_files, save_vector_store_file, remove_vector_store_file
+from metrics import span
+
+# Filename lookups in flight at once during a refresh
+CATALOG_LOOKUP_CONCURRENCY = int(os.getenv("CATALOG_LOOKUP_CONCURRENCY", "8"))
+CATALOG_PAGE_SIZE = 100
+
+class VectorStoreCatalog:
+    """
+    id -> filename index of the files in each vector store, kept in memory and persisted in
+    SQLite so a restart doesn't need to relist anything.
+
+    A refresh pages through the store's file list and only looks up filenames it doesn't
+    already know, concurrently. Uploads and deletes patch the index directly instead of
+    triggering a relist. Every change to a store's files bumps its version, which the agent
+    response cache keys on.
+    """
+
+    def __init__(self):
+        self._files = {}
+        self._versions = {}
+        self._listed = set()  # Stores listed from OpenAI at least once, even if they turned out empty
+        self._locks = {}
+
+    def _lock(self, vector_store_id):
+        if vector_store_id not in self._locks:
+            self._locks[vector_store_id] = asyncio.Lock()
+        return self._locks[vector_store_id]
+
+    async def _load(self, vector_store_id):
+        """Load the persisted index on first use. Returns True if the store still needs listing."""
+        if vector_store_id not in self._files:
+            self._files[vector_store_id] = await run_in_db(load_vector_store_files, vector_store_id)
+            self._versions[vector_store_id] = await run_in_db(load_vector_store_version, vector_store_id)
+            if self._files[vector_store_id]:
+                self._listed.add(vector_store_id)
+        return vector_store_id not in self._listed
+
+    async def list_files(self, vector_store_id, refresh=False):
+        """Return [{"id", "name"}] for a vector store, sorted by name. Lists it from OpenAI only when unknown or asked to refresh."""
+        async with self._lock(vector_store_id):
+            if await self._load(vector_store_id) or refresh:
+                await self._refresh(vector_store_id)
+        files = self._files[vector_store_id]
+        return sorted(({"id": file_id, "name": name} for file_id, name in files.items()), key=lambda file: (file["name"] or "").lower())
+
+    async def version(self, vector_store_id):
+        """Return the store's content version; it changes whenever files are added or removed."""
+        if vector_store_id not in self._versions:
+            async with self._lock(vector_store_id):
+                await self._load(vector_store_id)
+        return self._versions[vector_store_id]
+
+    async def _refresh(self, vector_store_id):
+        with span("catalog.refresh"):
+            file_ids = [file.id async for file in get_client().vector_stores.files.list(vector_store_id=vector_store_id, limit=CATALOG_PAGE_SIZE)]
+            known = self._files.get(vector_store_id, {})
+            missing = [file_id for file_id in file_ids if file_id not in known]
+            semaphore = asyncio.Semaphore(CATALOG_LOOKUP_CONCURRENCY)
+
+            async def lookup(file_id):
+                async with semaphore:
+                    return file_id, (await get_client().files.retrieve(file_id=file_id)).filename
+
+            names = dict(await asyncio.gather(*(lookup(file_id) for file_id in missing)))
+            files = {file_id: known.get(file_id) or names.get(file_id) for file_id in file_ids}
+            self._files[vector_store_id] = files
+            self._listed.add(vector_store_id)
+            self._versions[vector_store_id] = await run_in_db(replace_vector_store_files, vector_store_id, files)
+        print(f"Vector store {vector_store_id}: {len(files)} files ({len(missing)} new filename lookups).")
+
+    async def add(self, vector_store_id, file_id, filename):
+        """Record a file just attached to a vector store."""
+        async with self._lock(vector_store_id):
+            await self._load(vector_store_id)
+            self._files[vector_store_id][file_id] = filename
+            self._versions[vector_store_id] = await run_in_db(save_vector_store_file, vector_store_id, file_id, filename)
+
+    async def remove(self, vector_store_id, file_id):
+        """Forget a file just removed from a vector store."""
+        async with self._lock(vector_store_id):
+            await self._load(vector_store_id)
+            self._files[vector_store_id].pop(file_id, None)
+            self._versions[vector_store_id] = await run_in_db(remove_vector_store_file, vector_store_id, file_id)
+
+catalog = VectorStoreCatalog()
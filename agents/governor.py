@@ -0,0 +1,161 @@
+import asyncio
+import os
+import random
+import re
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import httpx
+from rate_limit import TokenBucket
+
+# Our OpenAI tier's limits. Requests and tokens are budgeted locally so batch runs stay just
+# under them instead of bouncing off 429s.
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "30000"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "6"))
+OPENAI_BACKOFF_BASE_SECONDS = float(os.getenv("OPENAI_BACKOFF_BASE_SECONDS", "1"))
+OPENAI_BACKOFF_MAX_SECONDS = float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", "60"))
+# Tokens a run costs beyond its message text: instructions plus file_search context
+RUN_TOKEN_OVERHEAD = int(os.getenv("OPENAI_RUN_TOKEN_OVERHEAD", "4000"))
+# Roughly what one high-detail image costs once downscaled to 768px on the short side
+IMAGE_TOKENS = 765
+
+# The same statuses the OpenAI SDK retries by default
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+def parse_duration(value):
+    """Parse an OpenAI reset header such as '20ms', '1s' or '6m0s' into seconds, or None."""
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value or "")
+    if not parts:
+        return None
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+def _retry_after(response):
+    """Seconds the server asked us to wait (retry-after-ms, or retry-after as seconds or a date), or None."""
+    retry_after_ms = response.headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = response.headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        try:
+            return max((parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds(), 0)
+        except (TypeError, ValueError):
+            return None
+
+class RateGovernor:
+    """
+    Shared budget for every OpenAI call: a requests-per-minute bucket charged per HTTP
+    request and a tokens-per-minute bucket charged per assistant run (an estimate up front,
+    settled with the run's real usage afterwards). The x-ratelimit-* response headers keep
+    both buckets honest, and a 429 pauses every caller until the server's reset time.
+    """
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm / 60, rpm)
+        self.tokens = TokenBucket(tpm / 60, tpm)
+        self.paused_until = 0
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0}
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def wait_for_request(self):
+        while (delay := self.paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+        await self.requests.acquire()
+        self.stats["requests"] += 1
+
+    async def reserve_tokens(self, estimate):
+        await self.tokens.acquire(estimate)
+
+    def settle_tokens(self, estimate, actual):
+        """Correct a reservation once the run's real token usage is known."""
+        self.tokens.adjust(estimate - actual)
+
+    def observe(self, response):
+        """Sync the local buckets with the limits OpenAI reports on every response."""
+        for header, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+            try:
+                remaining = float(response.headers[f"x-ratelimit-remaining-{header}"])
+            except (KeyError, ValueError):
+                continue
+            if remaining < bucket.available():
+                bucket.adjust(remaining - bucket.available())
+            if remaining <= 0:
+                reset = parse_duration(response.headers.get(f"x-ratelimit-reset-{header}"))
+                if reset:
+                    self.pause(reset)
+
+    def retry_delay(self, attempt, response=None):
+        """Server-requested delay plus a little jitter, or exponential backoff with full jitter."""
+        retry_after = _retry_after(response) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, OPENAI_BACKOFF_MAX_SECONDS) * random.uniform(1, 1.2)
+        return random.uniform(0, min(OPENAI_BACKOFF_BASE_SECONDS * (2 ** attempt), OPENAI_BACKOFF_MAX_SECONDS))
+
+class GovernedTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport that puts every OpenAI request through the governor and retries
+    429/5xx responses and connection failures itself, so the SDK runs with max_retries=0
+    and all callers share one backoff instead of retrying independently.
+    """
+
+    def __init__(self, governor, transport=None):
+        self.governor = governor
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request):
+        for attempt in range(OPENAI_MAX_RETRIES + 1):
+            last_attempt = attempt == OPENAI_MAX_RETRIES
+            await self.governor.wait_for_request()
+            try:
+                response = await self._transport.handle_async_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                if last_attempt:
+                    raise
+                delay = self.governor.retry_delay(attempt)
+                print(f"OpenAI connection failed ({e}); retrying in {delay:.1f}s...")
+                self.governor.stats["retries"] += 1
+                await asyncio.sleep(delay)
+                continue
+
+            self.governor.observe(response)
+            if response.status_code not in RETRY_STATUSES or last_attempt:
+                return response
+            delay = self.governor.retry_delay(attempt, response)
+            if response.status_code == 429:
+                # Everyone waits, not just this caller: the quota is shared
+                self.governor.stats["rate_limited"] += 1
+                self.governor.pause(delay)
+            self.governor.stats["retries"] += 1
+            print(f"OpenAI {request.method} {request.url.path} returned {response.status_code}; retrying in {delay:.1f}s...")
+            await response.aclose()
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+def estimate_run_tokens(content, instructions=None):
+    """Rough token cost of a run, reserved before it starts (about four characters per token)."""
+    text = "".join(part["text"] for part in content if part["type"] == "text") + (instructions or "")
+    images = sum(1 for part in content if part["type"] in ("image_url", "image_file"))
+    return len(text) // 4 + images * IMAGE_TOKENS + RUN_TOKEN_OVERHEAD
+
+governor = RateGovernor(OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT)
+
+def create_http_client():
+    """The httpx client handed to AsyncOpenAI, routing every request through the governor."""
+    return httpx.AsyncClient(
+        transport=GovernedTransport(governor),
+        timeout=httpx.Timeout(600, connect=10),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        follow_redirects=True
+    )
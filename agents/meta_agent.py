@@ -1,9 +1,6 @@
-from openai import OpenAI
-import time  # Explicit import
-import os
+from agents.cache import run_assistant_cached
+from agents.runtime import create_assistant
 
-
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 META_AGENT_ID = "asst_mIB7i3swLSMEZCg0G4FnMYGt"
 
 META_AGENT_PROMPT = """
@@ -19,41 +16,12 @@ Tasks:
    - Use an encouraging tone to motivate the user to continue improving.
 """
 
-def get_final_comment(technical_feedback, historical_feedback):
+async def get_final_comment(technical_feedback, historical_feedback, on_delta=None, instructions=None, use_cache=True):
     global META_AGENT_ID
     
     if not META_AGENT_ID:
         print("No META_AGENT_ID provided. Creating a new assistant...")
-        new_assistant = client.beta.assistants.create(
-            name="Meta Agent",
-            instructions=META_AGENT_PROMPT,
-            model="gpt-4o"
-        )
-        META_AGENT_ID = new_assistant.id
-        print(f"New Meta Agent created with ID: {META_AGENT_ID}")
+        META_AGENT_ID = await create_assistant("Meta Agent", META_AGENT_PROMPT)
 
-    thread = client.beta.threads.create()
-    client.beta.threads.messages.create(
-        thread_id=thread.id,
-        role="user",
-        content=[{"type": "text", "text": f"Technical Feedback: {technical_feedback}\nHistorical Feedback: {historical_feedback}"}]
-    )
-    
-    run = client.beta.threads.runs.create(thread_id=thread.id, assistant_id=META_AGENT_ID)
-    timeout = 60
-    start_time = time.time()
-    while True:
-        if time.time() - start_time > timeout:
-            raise Exception(f"Assistant run timed out after {timeout} seconds.")
-        
-        run_status = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-        print(f"Run status (Meta Agent): {run_status.status}")
-        if run_status.status == "completed":
-            break
-        elif run_status.status in ["failed", "cancelled", "expired"]:
-            raise Exception(f"Assistant run failed with status: {run_status.status}")
-        time.sleep(2)  # Should now work with explicit import
-    
-    messages = client.beta.threads.messages.list(thread_id=thread.id)
-    feedback = messages.data[0].content[0].text.value
-    return feedback
\ No newline at end of file
+    content = [{"type": "text", "text": f"Technical Feedback: {technical_feedback}\nHistorical Feedback: {historical_feedback}"}]
+    return await run_assistant_cached(META_AGENT_ID, content, label="Meta Agent", on_delta=on_delta, instructions=instructions, use_cache=use_cache)
\ No newline at end of file
@@ -0,0 +1,75 @@
+import asyncio
+from agents.runtime import get_client
+
+class AssistantRegistry:
+    """
+    In-process cache of assistant configuration: instructions and attached vector stores.
+
+    Each assistant is retrieved once and served from memory afterwards. Entries are only
+    invalidated when something changes them (prompt updates, vector store uploads/deletes).
+    """
+
+    def __init__(self):
+        self._assistants = {}
+        self._locks = {}
+
+    def _lock(self, assistant_id):
+        if assistant_id not in self._locks:
+            self._locks[assistant_id] = asyncio.Lock()
+        return self._locks[assistant_id]
+
+    async def get(self, assistant_id):
+        """Return the cached assistant, retrieving it on first use."""
+        assistant = self._assistants.get(assistant_id)
+        if assistant is not None:
+            return assistant
+        # Concurrent posts share a single retrieve per assistant
+        async with self._lock(assistant_id):
+            if assistant_id not in self._assistants:
+                print(f"Retrieving configuration for assistant {assistant_id}...")
+                self._assistants[assistant_id] = await get_client().beta.assistants.retrieve(assistant_id)
+            return self._assistants[assistant_id]
+
+    async def get_instructions(self, assistant_id):
+        """Return the assistant's current instructions."""
+        return (await self.get(assistant_id)).instructions
+
+    @staticmethod
+    def _vector_store_ids(assistant):
+        tool_resources = getattr(assistant, "tool_resources", None)
+        if not tool_resources or not tool_resources.file_search:
+            return []
+        return list(tool_resources.file_search.vector_store_ids or [])
+
+    async def get_vector_store_ids(self, assistant_id):
+        """Return the vector store IDs attached to the assistant's file_search tool."""
+        return self._vector_store_ids(await self.get(assistant_id))
+
+    async def ensure_vector_store(self, assistant_id, vector_store_id):
+        """Attach `vector_store_id` to the assistant if it has no vector store attached yet."""
+        if await self.get_vector_store_ids(assistant_id):
+            return
+        async with self._lock(assistant_id):
+            assistant = self._assistants.get(assistant_id) or await get_client().beta.assistants.retrieve(assistant_id)
+            if not self._vector_store_ids(assistant):
+                print(f"Attaching vector store {vector_store_id} to assistant {assistant_id}...")
+                assistant = await get_client().beta.assistants.update(
+                    assistant_id,
+                    tool_resources={"file_search": {"vector_store_ids": [vector_store_id]}}
+                )
+                print(f"Vector store {vector_store_id} attached to assistant.")
+            self._assistants[assistant_id] = assistant
+
+    async def update_instructions(self, assistant_id, instructions):
+        """Persist new instructions on the assistant and refresh the cached entry."""
+        async with self._lock(assistant_id):
+            self._assistants[assistant_id] = await get_client().beta.assistants.update(assistant_id, instructions=instructions)
+
+    def invalidate(self, assistant_id=None):
+        """Drop one cached assistant, or all of them when no ID is given."""
+        if assistant_id is None:
+            self._assistants.clear()
+        else:
+            self._assistants.pop(assistant_id, None)
+
+registry = AssistantRegistry()
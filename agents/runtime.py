@@ -0,0 +1,137 @@
+import asyncio
+import os
+from agents.governor import governor, create_http_client, estimate_run_tokens
+from metrics import span, record_usage
+
+_client = None
+
+def get_client():
+    """Return the shared AsyncOpenAI client, creating it on first use (never at import time)."""
+    global _client
+    if _client is None:
+        # Imported here: the openai package alone takes most of a second to import
+        from openai import AsyncOpenAI
+        # Retries (429/5xx, with Retry-After and jitter) are handled by the governed transport
+        _client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0, http_client=create_http_client())
+    return _client
+
+RUN_TIMEOUT_SECONDS = int(os.getenv("AGENT_RUN_TIMEOUT_SECONDS", "60"))
+POLL_INTERVAL_SECONDS = float(os.getenv("AGENT_POLL_INTERVAL_SECONDS", "1"))
+# Stream run output token by token instead of polling for the finished run
+STREAMING_ENABLED = os.getenv("AGENT_STREAMING", "1") == "1"
+
+# Runs currently in flight, keyed by run ID -> thread ID, so they can be cancelled on shutdown
+active_runs = {}
+
+async def create_assistant(name, instructions, tools=None, model="gpt-4o"):
+    """Create a new assistant and return its ID."""
+    print(f"Creating a new assistant: {name}...")
+    assistant = await get_client().beta.assistants.create(
+        name=name,
+        instructions=instructions,
+        tools=tools or [],
+        model=model
+    )
+    print(f"New {name} created with ID: {assistant.id}")
+    return assistant.id
+
+async def cancel_run(thread_id, run_id):
+    """Ask OpenAI to cancel a run. Errors are logged, not raised."""
+    try:
+        await get_client().beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+        print(f"Cancelled run {run_id} on thread {thread_id}")
+    except Exception as e:
+        print(f"Failed to cancel run {run_id}: {e}")
+
+async def cancel_all_runs():
+    """Cancel every run that is still in flight."""
+    await asyncio.gather(*(cancel_run(thread_id, run_id) for run_id, thread_id in list(active_runs.items())))
+
+async def _poll_run(thread_id, assistant_id, label, run_ref, run_options):
+    """Start a run and poll it until it leaves the queued/in_progress states. Returns the reply text."""
+    run = await get_client().beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id, **run_options)
+    run_ref["id"] = run.id
+    active_runs[run.id] = thread_id
+    while run.status in ("queued", "in_progress", "cancelling"):
+        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+        with span("agent.poll", agent=label):
+            run = await get_client().beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+        print(f"Run status ({label}): {run.status}")
+
+    run_ref["usage"] = run.usage
+    if run.status != "completed":
+        raise Exception(f"Assistant run failed with status: {run.status}")
+
+    with span("agent.messages", agent=label):
+        messages = await get_client().beta.threads.messages.list(thread_id=thread_id)
+    return messages.data[0].content[0].text.value
+
+async def _stream_run(thread_id, assistant_id, label, on_delta, run_ref, run_options):
+    """Start a streamed run, forwarding text deltas to `on_delta` as they arrive. Returns the reply text."""
+    parts = []
+    async with get_client().beta.threads.runs.stream(thread_id=thread_id, assistant_id=assistant_id, **run_options) as stream:
+        async for event in stream:
+            if event.event == "thread.run.created":
+                run_ref["id"] = event.data.id
+                active_runs[event.data.id] = thread_id
+            elif event.event == "thread.message.delta":
+                for part in event.data.delta.content or []:
+                    if part.type == "text" and part.text and part.text.value:
+                        parts.append(part.text.value)
+                        if on_delta:
+                            await on_delta(part.text.value)
+        run = await stream.get_final_run()
+
+    run_ref["usage"] = run.usage
+    print(f"Run status ({label}): {run.status}")
+    if run.status != "completed":
+        raise Exception(f"Assistant run failed with status: {run.status}")
+    return "".join(parts)
+
+async def run_assistant(assistant_id, content, label="Agent", timeout=RUN_TIMEOUT_SECONDS, on_delta=None, instructions=None):
+    """
+    Run an assistant on a fresh thread with a single user message and return the reply text.
+
+    With AGENT_STREAMING enabled (the default) the reply is streamed and every text delta is
+    passed to the async `on_delta` callback as it is generated; otherwise the run is polled
+    and `on_delta` receives the full reply once. Either way nothing blocks the event loop.
+    If the run times out or the calling task is cancelled, the run is cancelled on the
+    OpenAI side as well.
+
+    `instructions` overrides the assistant's instructions for this run only, leaving the
+    assistant itself (and every other run) untouched.
+
+    The run's estimated token cost is reserved with the rate governor before it starts and
+    settled with the real usage afterwards, so concurrent runs stay within the TPM limit.
+    """
+    run_options = {"instructions": instructions} if instructions else {}
+    estimated_tokens = estimate_run_tokens(content, instructions)
+    with span("agent.rate_wait", agent=label):
+        await governor.reserve_tokens(estimated_tokens)
+    with span("agent.thread", agent=label):
+        thread = await get_client().beta.threads.create()
+        await get_client().beta.threads.messages.create(thread_id=thread.id, role="user", content=content)
+    run_ref = {}
+    try:
+        async with asyncio.timeout(timeout):
+            with span("agent.run", agent=label):
+                if STREAMING_ENABLED:
+                    return await _stream_run(thread.id, assistant_id, label, on_delta, run_ref, run_options)
+                feedback = await _poll_run(thread.id, assistant_id, label, run_ref, run_options)
+            if on_delta:
+                await on_delta(feedback)
+            return feedback
+    except TimeoutError:
+        if "id" in run_ref:
+            await cancel_run(thread.id, run_ref["id"])
+        raise Exception(f"Assistant run timed out after {timeout} seconds.")
+    except asyncio.CancelledError:
+        if "id" in run_ref:
+            await asyncio.shield(cancel_run(thread.id, run_ref["id"]))
+        raise
+    finally:
+        active_runs.pop(run_ref.get("id"), None)
+        usage = run_ref.get("usage")
+        if usage:
+            governor.settle_tokens(estimated_tokens, usage.total_tokens)
+            record_usage(label, usage)
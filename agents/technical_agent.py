@@ -1,9 +1,8 @@
-import asyncio
-from openai import AsyncOpenAI
+from agents.cache import run_assistant_cached
+from agents.registry import registry
+from agents.runtime import create_assistant
 import re
-import os
 
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 TECHNICAL_AGENT_ID = "asst_ZsB2PzpoJYU98sqcSmwTG0er"
 
 TECHNICAL_AGENT_PROMPT = """
@@ -17,58 +16,24 @@ Do not include information from other adventure files unless the specific file f
 Provide detailed feedback based on the adventure files in the selected vector store, prioritizing the file that matches the adventure number mentioned in the post. If no adventure number is mentioned, you may use all relevant files from the vector store to provide a comprehensive response.
 """
 
-async def get_technical_feedback(image_url, vector_store_id, content_stripped=""):
+async def get_technical_feedback(image_parts, vector_store_id, content_stripped="", on_delta=None, instructions=None, use_cache=True):
     global TECHNICAL_AGENT_ID
     
     if not TECHNICAL_AGENT_ID:
         print("No TECHNICAL_AGENT_ID provided. Creating a new assistant...")
-        new_assistant = await client.beta.assistants.create(
-            name="Technical Agent",
-            instructions=TECHNICAL_AGENT_PROMPT,
-            tools=[{"type": "file_search"}],
-            model="gpt-4o"
-        )
-        TECHNICAL_AGENT_ID = new_assistant.id
-        print(f"New Technical Agent created with ID: {TECHNICAL_AGENT_ID}")
+        TECHNICAL_AGENT_ID = await create_assistant("Technical Agent", TECHNICAL_AGENT_PROMPT, tools=[{"type": "file_search"}])
     else:
         print(f"Using existing Technical Agent with ID: {TECHNICAL_AGENT_ID}")
 
-    assistant = await client.beta.assistants.retrieve(TECHNICAL_AGENT_ID)
-    
     if not vector_store_id:
         raise Exception("No vector_store_id provided. Cannot proceed without a vector store.")
     
-    if not hasattr(assistant, "tool_resources") or not assistant.tool_resources.file_search or not assistant.tool_resources.file_search.vector_store_ids:
-        print(f"Attaching vector store {vector_store_id} to assistant {TECHNICAL_AGENT_ID}...")
-        assistant = await client.beta.assistants.update(
-            TECHNICAL_AGENT_ID,
-            tool_resources={"file_search": {"vector_store_ids": [vector_store_id]}}
-        )
-        print(f"Vector store {vector_store_id} attached to assistant.")
+    await registry.ensure_vector_store(TECHNICAL_AGENT_ID, vector_store_id)
 
-    thread = await client.beta.threads.create()
-    content = [{"type": "text", "text": f"Analyze this: {content_stripped}"}]
-    if image_url:
-        content.append({"type": "image_url", "image_url": {"url": image_url}})
-    
-    await client.beta.threads.messages.create(
-        thread_id=thread.id,
-        role="user",
-        content=content
-    )
+    # image_parts come from image_pipeline.prepare_images: deduplicated, downscaled, uploaded images
+    content = [{"type": "text", "text": f"Analyze this: {content_stripped}"}] + list(image_parts or [])
     
-    # Use create_and_poll to avoid manual polling
-    run = await client.beta.threads.runs.create_and_poll(
-        thread_id=thread.id,
-        assistant_id=TECHNICAL_AGENT_ID,
-        poll_interval_ms=1000  # Check every 1 second
-    )
-    
-    if run.status != "completed":
-        raise Exception(f"Assistant run failed with status: {run.status}")
-
-    messages = await client.beta.threads.messages.list(thread_id=thread.id)
-    feedback = messages.data[0].content[0].text.value
+    feedback = await run_assistant_cached(TECHNICAL_AGENT_ID, content, label="Technical Agent", on_delta=on_delta, instructions=instructions, use_cache=use_cache)
     adventure_number = int(adventure_match.group(1)) if (adventure_match := re.search(r"Adventure (\d+)", feedback)) else None
     
     return feedback, adventure_number
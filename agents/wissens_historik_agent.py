@@ -1,9 +1,13 @@
-from openai import OpenAI
-from database import fetch_user_history
-import time
 import os
+from agents.cache import run_assistant_cached
+from agents.registry import registry
+from agents.runtime import create_assistant
+from database import fetch_user_history_summary, fetch_recent_user_history, run_in_db
+
+# Only the last few submissions are sent in full; older ones reach the assistant through the rolling summary
+HISTORY_RECENT_ENTRIES = int(os.getenv("HISTORY_RECENT_ENTRIES", "3"))
+HISTORY_FIELD_MAX_CHARS = int(os.getenv("HISTORY_FIELD_MAX_CHARS", "1500"))
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 KNOWLEDGE_HISTORIK_AGENT_ID = "asst_YrshuDTagBGcf8JqdoRq1Ywk"
 
 KNOWLEDGE_HISTORIK_PROMPT = """
@@ -21,66 +25,58 @@ If no historical data is available, return:
 - Summary: "No historical data available for this user."
 """
 
-def get_historical_feedback(user_id, vector_store_id):
+def _truncate(text, max_chars=HISTORY_FIELD_MAX_CHARS):
+    text = text or ""
+    return text if len(text) <= max_chars else text[:max_chars - 1] + "…"
+
+def format_history(summary, recent):
+    """Render the rolling summary plus the recent entries as the text sent to the assistant."""
+    history_text = ""
+    recent_post_ids = {entry[0] for entry in recent}
+    if summary:
+        rated = summary.get("rated_entries") or 0
+        average_rating = f"{summary['rating_total'] / rated:.1f}" if rated else "n/a"
+        adventures = ", ".join(f"{name} ({count}x)" for name, count in summary["adventures"].items())
+        history_text += "User History Summary:\n"
+        history_text += f"- Submissions: {summary['entries']} between {summary.get('first_post_date')} and {summary.get('last_post_date')}\n"
+        history_text += f"- Average rating: {average_rating}\n"
+        history_text += f"- Adventures: {adventures}\n"
+        # Earlier notes only; the recent entries are listed in full below
+        notes = [note for note in summary["notes"] if note["post_id"] not in recent_post_ids]
+        if notes:
+            history_text += "Earlier Feedback:\n"
+            for note in notes:
+                history_text += f"- Post ID: {note['post_id']}, Adventure: {note['adventure']}, Date: {note['date']}: {note['note']}\n"
+
+    if recent:
+        history_text += "Recent Submissions:\n"
+        for entry in recent:
+            post_id, content, adventure_name, image_urls, technical_analysis, knowledge_history, final_comment, rating, post_date = entry
+            history_text += f"- Post ID: {post_id}, Adventure: {adventure_name}, Content: {_truncate(content)}, Technical Analysis: {_truncate(technical_analysis)}, Final Comment: {_truncate(final_comment)}, Date: {post_date}\n"
+    return history_text
+
+async def get_historical_feedback(user_id, vector_store_id, on_delta=None, instructions=None, use_cache=True):
     global KNOWLEDGE_HISTORIK_AGENT_ID
     
     if not KNOWLEDGE_HISTORIK_AGENT_ID:
         print("No KNOWLEDGE_HISTORIK_AGENT_ID provided. Creating a new assistant...")
-        new_assistant = client.beta.assistants.create(
-            name="Wissens-Historik Agent",
-            instructions=KNOWLEDGE_HISTORIK_PROMPT,
-            tools=[{"type": "file_search"}],
-            model="gpt-4o"
-        )
-        KNOWLEDGE_HISTORIK_AGENT_ID = new_assistant.id
-        print(f"New Wissens-Historik Agent created with ID: {KNOWLEDGE_HISTORIK_AGENT_ID}")
+        KNOWLEDGE_HISTORIK_AGENT_ID = await create_assistant("Wissens-Historik Agent", KNOWLEDGE_HISTORIK_PROMPT, tools=[{"type": "file_search"}])
 
-    assistant = client.beta.assistants.retrieve(KNOWLEDGE_HISTORIK_AGENT_ID)
-    
     if not vector_store_id:
         raise Exception("No vector_store_id provided. Cannot proceed without a vector store.")
     
-    if not hasattr(assistant, "tool_resources") or not assistant.tool_resources.file_search or not assistant.tool_resources.file_search.vector_store_ids:
-        print(f"Attaching vector store {vector_store_id} to assistant {KNOWLEDGE_HISTORIK_AGENT_ID}...")
-        assistant = client.beta.assistants.update(
-            KNOWLEDGE_HISTORIK_AGENT_ID,
-            tool_resources={"file_search": {"vector_store_ids": [vector_store_id]}}
-        )
-        print(f"Vector store {vector_store_id} attached to assistant.")
+    await registry.ensure_vector_store(KNOWLEDGE_HISTORIK_AGENT_ID, vector_store_id)
 
-    # Fetch user history
-    history = fetch_user_history(user_id)
-    if not history:
-        return "No historical data available for this user."
+    # Fetch the rolling summary and the most recent entries, so the prompt size stays flat as history grows
+    summary = await run_in_db(fetch_user_history_summary, user_id)
+    recent = await run_in_db(fetch_recent_user_history, user_id, HISTORY_RECENT_ENTRIES)
+    if not summary and not recent:
+        feedback = "No historical data available for this user."
+        if on_delta:
+            await on_delta(feedback)
+        return feedback
 
-    # Format history for the assistant
-    history_text = "User History:\n"
-    for entry in history:
-        post_id, content, adventure_name, image_urls, technical_analysis, knowledge_history, final_comment, rating, post_date = entry
-        history_text += f"- Post ID: {post_id}, Adventure: {adventure_name}, Content: {content}, Technical Analysis: {technical_analysis}, Final Comment: {final_comment}, Date: {post_date}\n"
+    history_text = format_history(summary, recent)
 
-    thread = client.beta.threads.create()
-    client.beta.threads.messages.create(
-        thread_id=thread.id,
-        role="user",
-        content=[{"type": "text", "text": f"Analyze the following user history:\n{history_text}"}]
-    )
-    
-    run = client.beta.threads.runs.create(thread_id=thread.id, assistant_id=KNOWLEDGE_HISTORIK_AGENT_ID)
-    timeout = 60
-    start_time = time.time()
-    while True:
-        if time.time() - start_time > timeout:
-            raise Exception(f"Assistant run timed out after {timeout} seconds.")
-        
-        run_status = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-        print(f"Run status (Historical Agent): {run_status.status}")
-        if run_status.status == "completed":
-            break
-        elif run_status.status in ["failed", "cancelled", "expired"]:
-            raise Exception(f"Assistant run failed with status: {run_status.status}")
-        time.sleep(2)
-    
-    messages = client.beta.threads.messages.list(thread_id=thread.id)
-    feedback = messages.data[0].content[0].text.value
-    return feedback
\ No newline at end of file
+    content = [{"type": "text", "text": f"Analyze the following user history:\n{history_text}"}]
+    return await run_assistant_cached(KNOWLEDGE_HISTORIK_AGENT_ID, content, label="Historical Agent", on_delta=on_delta, instructions=instructions, use_cache=use_cache)
\ No newline at end of file
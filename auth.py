@@ -1,5 +1,10 @@
 import os
-import requests
+import time
+import json
+import base64
+import asyncio
+import httpx
+import http_client
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -10,74 +15,141 @@ BASE_URL = "https://my.hairdressing.school"  # Updated to production domain
 USERNAME = os.getenv("WP_USERNAME", "Hairdressing.school Mentor")
 PASSWORD = os.getenv("WP_PASSWORD", "wyCs ESkt qkpT tzrh hsUJ uL6G")
 
-# Global variables for token and expiry
-token = None
-token_expiry = 0
+# Refresh this many seconds before the token's exp claim
+REFRESH_MARGIN_SECONDS = int(os.getenv("JWT_REFRESH_MARGIN_SECONDS", "300"))
+# Assumed lifetime when the token carries no readable exp claim
+DEFAULT_TOKEN_LIFETIME_SECONDS = 3600
 
-def get_jwt_token():
+def decode_jwt_expiry(jwt):
+    """Return the exp claim of a JWT as a Unix timestamp (without verifying the signature), or None."""
+    try:
+        payload = jwt.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+async def login():
     """
-    Authenticate with the BuddyBoss API and return a JWT token.
+    Authenticate with the BuddyBoss API and return a fresh JWT token.
     """
-    global token, token_expiry
     print("🔑 Authenticating to get JWT token...")
-    
+
     auth_url = f"{BASE_URL}/wp-json/jwt-auth/v1/token"
-    
+
     payload = {
         "username": USERNAME,
         "password": PASSWORD
     }
     try:
-        response = requests.post(auth_url, json=payload, timeout=10)
-        
-        # Print out the full response for debugging
+        response = await http_client.post(auth_url, json=payload, retry_unsafe=True)
         print(f"Response status code: {response.status_code}")
-        print(f"Response content: {response.text}")
-        
-        response.raise_for_status()
+
         data = response.json()
         token = data.get("token")
-        
+
         if not token:
             raise ValueError("No token received from JWT authentication")
-        
-        token_expiry = 3600  # Token expiry is typically 1 hour (3600 seconds)
+
         print("✓ JWT token obtained successfully!")
         return token
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"❌ Failed to obtain JWT token: {e}")
         raise
 
-def verify_connection(current_token=None):
+class TokenManager:
     """
-    Verify connection to the BuddyBoss API.
+    One JWT shared by every BuddyBoss caller.
+
+    The token's real expiry is read from its exp claim. A background task refreshes it
+    REFRESH_MARGIN_SECONDS before it expires, and a lock makes sure only one login is in
+    flight at a time: concurrent callers wait for that login instead of starting their own.
     """
-    global token, token_expiry
-    
-    # If no token is provided or the token has expired, fetch a new one
-    if not current_token or token_expiry <= 0:
+
+    def __init__(self):
+        self.token = None
+        self.expires_at = 0
+        self._lock = asyncio.Lock()
+        self._refresh_task = None
+
+    def is_fresh(self):
+        return self.token is not None and time.time() < self.expires_at - REFRESH_MARGIN_SECONDS
+
+    async def get_token(self):
+        """Return a valid token, logging in only if there is none or it is about to expire."""
+        if self.is_fresh():
+            return self.token
+        return await self.refresh()
+
+    async def refresh(self, rejected_token=None):
+        """
+        Log in and store a new token. If another caller already refreshed while we waited
+        for the lock, its token is returned instead. `rejected_token` is a token the server
+        answered 401 for; it is replaced even if it looks fresh.
+        """
+        async with self._lock:
+            if self.is_fresh() and self.token != rejected_token:
+                return self.token
+            token = await login()
+            self.token = token
+            self.expires_at = decode_jwt_expiry(token) or time.time() + DEFAULT_TOKEN_LIFETIME_SECONDS
+            print(f"JWT token valid for {int(self.expires_at - time.time())} seconds.")
+            self._schedule_refresh()
+            return token
+
+    def _schedule_refresh(self):
+        if self._refresh_task and not self._refresh_task.done() and self._refresh_task is not asyncio.current_task():
+            self._refresh_task.cancel()
+        delay = max(self.expires_at - REFRESH_MARGIN_SECONDS - time.time(), 0)
+        self._refresh_task = asyncio.create_task(self._refresh_later(delay))
+
+    async def _refresh_later(self, delay):
+        await asyncio.sleep(delay)
         try:
-            current_token = get_jwt_token()
-        except requests.exceptions.RequestException:
-            return False
+            await self.refresh()
+        except Exception as e:
+            # The next caller will retry the login in the foreground
+            print(f"Background JWT refresh failed: {e}")
 
-    # Use the token to verify the connection
-    headers = {
-        "Authorization": f"Bearer {current_token}"
-    }
+    async def close(self):
+        """Stop the background refresh task."""
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
+
+token_manager = TokenManager()
+
+async def get_jwt_token():
+    """
+    Return the shared JWT token, authenticating only when needed.
+    """
+    return await token_manager.get_token()
+
+async def authorized_request(method, url, **kwargs):
+    """
+    Send a request with the shared bearer token. On a 401 the token is refreshed once and
+    the request retried, so an expired or revoked token is replaced transparently.
+    """
+    headers = kwargs.pop("headers", None) or {}
+    token = await get_jwt_token()
+    try:
+        return await http_client.request(method, url, headers={**headers, "Authorization": f"Bearer {token}"}, **kwargs)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code != 401:
+            raise
+        print("BuddyBoss API rejected the JWT token; refreshing and retrying...")
+        token = await token_manager.refresh(rejected_token=token)
+        return await http_client.request(method, url, headers={**headers, "Authorization": f"Bearer {token}"}, **kwargs)
+
+async def verify_connection():
+    """
+    Verify connection to the BuddyBoss API.
+    """
     test_url = f"{BASE_URL}/wp-json/buddyboss/v1/activity"
-    
+
     try:
-        response = requests.get(test_url, headers=headers, timeout=5)
-        response.raise_for_status()
+        await authorized_request("GET", test_url, params={"per_page": 1}, timeout=5)
         print("✓ Connection verified successfully!")
         return True
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, ValueError) as e:
         print(f"❌ Connection verification failed: {e}")
         return False
-
-# Generate token on import
-try:
-    token = get_jwt_token()
-except requests.exceptions.RequestException as e:
-    print(f"Failed to initialize JWT token on import: {e}")
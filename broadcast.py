@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+from collections import deque
+from metrics import span, WEBSOCKET_MESSAGES
+
+# Messages buffered per dashboard connection before it counts as a slow consumer
+WS_CLIENT_QUEUE_SIZE = int(os.getenv("WS_CLIENT_QUEUE_SIZE", "256"))
+# A single send that takes longer than this disconnects the client; the dashboard reconnects
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+
+class _Client:
+    """One connection's outgoing queue. Entries are [coalesce_key, message, encoded_text]."""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        self.writer = None
+
+class BroadcastHub:
+    """
+    Fan-out of dashboard messages to every connected WebSocket.
+
+    Each connection gets a bounded queue drained by its own writer task, so publishing never
+    waits on a socket and one stalled browser can't hold up the others. A message is encoded
+    to JSON once, however many clients receive it. When a client falls behind, consecutive
+    partial_feedback deltas for the same post and agent are merged into one message; if its
+    queue still fills up, queued deltas are dropped first (the finished post carries the full
+    text) and a client that is full of anything else is disconnected.
+    """
+
+    def __init__(self, queue_size, send_timeout):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self._clients = {}
+        self._closing = set()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def register(self, websocket):
+        client = _Client(websocket)
+        client.writer = asyncio.create_task(self._write(client))
+        self._clients[websocket] = client
+
+    def unregister(self, websocket):
+        client = self._clients.pop(websocket, None)
+        if client and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+
+    def broadcast(self, message):
+        """Queue `message` for every connected client. Never blocks."""
+        if not self._clients:
+            return
+        text = json.dumps(message)
+        for client in list(self._clients.values()):
+            self._enqueue(client, message, text)
+
+    def send(self, websocket, message):
+        """Queue `message` for one client (a reply to its own request). Never blocks."""
+        client = self._clients.get(websocket)
+        if client:
+            self._enqueue(client, message, json.dumps(message))
+
+    def _enqueue(self, client, message, text):
+        key = _coalesce_key(message)
+        queue = client.queue
+        if key and queue and queue[-1][0] == key:
+            # The writer hasn't caught up yet: fold this delta into the one already waiting
+            tail = queue[-1]
+            merged = dict(tail[1]["partial_feedback"])
+            merged["delta"] += message["partial_feedback"]["delta"]
+            tail[1], tail[2] = {"partial_feedback": merged}, None
+            WEBSOCKET_MESSAGES.inc(outcome="coalesced")
+            return
+        if len(queue) >= self.queue_size:
+            for i, entry in enumerate(queue):
+                if entry[0]:
+                    del queue[i]
+                    WEBSOCKET_MESSAGES.inc(outcome="dropped")
+                    break
+            else:
+                print(f"Disconnecting slow WebSocket client: {len(queue)} messages queued.")
+                WEBSOCKET_MESSAGES.inc(len(queue) + 1, outcome="dropped")
+                self._disconnect(client)
+                return
+        queue.append([key, message, text])
+        client.ready.set()
+
+    async def _write(self, client):
+        try:
+            while True:
+                await client.ready.wait()
+                while client.queue:
+                    _, message, text = client.queue.popleft()
+                    with span("websocket.send", traced=False):
+                        await asyncio.wait_for(client.websocket.send_text(text or json.dumps(message)), self.send_timeout)
+                    WEBSOCKET_MESSAGES.inc(outcome="sent")
+                client.ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except TimeoutError:
+            print(f"WebSocket send took longer than {self.send_timeout}s, disconnecting client.")
+            self._disconnect(client)
+        except Exception as e:
+            print(f"WebSocket send failed, disconnecting client: {e}")
+            self._disconnect(client)
+
+    def _disconnect(self, client):
+        self.unregister(client.websocket)
+        client.queue.clear()
+        # Closing makes the endpoint's receive loop exit; the dashboard then reconnects
+        task = asyncio.create_task(self._close(client.websocket))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close(self, websocket):
+        try:
+            await asyncio.wait_for(websocket.close(code=1013), self.send_timeout)
+        except Exception:
+            pass
+
+def _coalesce_key(message):
+    partial = message.get("partial_feedback")
+    if partial and len(message) == 1:
+        return (partial["post_id"], partial["agent"])
+    return None
+
+hub = BroadcastHub(WS_CLIENT_QUEUE_SIZE, WS_SEND_TIMEOUT_SECONDS)
@@ -1,29 +1,23 @@
-import requests
-from auth import get_jwt_token  # Import the function to get the token
+import httpx
+from auth import authorized_request  # Sends with the shared JWT token, refreshing it on 401
 
 class BuddyBossClient:
     def __init__(self):
         self.base_url = "https://stg-my-hairdresser-508.ew1.rapydapps.cloud/wp-json/buddyboss/v1"  # Correct base URL for BuddyBoss API
-        try:
-            self.token = get_jwt_token()  # Get the token dynamically
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Failed to obtain JWT token for BuddyBossClient: {e}")
-        self.headers = {"Authorization": f"Bearer {self.token}"}
 
-    def get_user_info(self, user_id):
+    async def get_user_info(self, user_id):
         """
         Fetch user information from BuddyBoss API.
         """
         url = f"{self.base_url}/members/{user_id}"
         try:
-            response = requests.get(url, headers=self.headers, timeout=10)
-            response.raise_for_status()
+            response = await authorized_request("GET", url)
             return response.json()
-        except requests.exceptions.RequestException as e:
+        except (httpx.HTTPError, ValueError) as e:
             print(f"Failed to fetch user info for user {user_id}: {e}")
             return None
 
-    def post_comment(self, activity_id, comment_content):
+    async def post_comment(self, activity_id, comment_content):
         """
         Post a comment on a specific activity.
         """
@@ -32,9 +26,8 @@ class BuddyBossClient:
             "content": comment_content
         }
         try:
-            response = requests.post(url, headers=self.headers, json=payload, timeout=10)
-            response.raise_for_status()
+            response = await authorized_request("POST", url, json=payload)
             return response.json()
-        except requests.exceptions.RequestException as e:
+        except (httpx.HTTPError, ValueError) as e:
             print(f"Failed to post comment on activity {activity_id}: {e}")
             return None
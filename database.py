@@ -1,139 +1,660 @@
 import sqlite3
 import json
+import os
+import re
+import asyncio
+import functools
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timezone
 
 DATABASE = "hairdressing_history.db"
 
+# Applied to every connection: WAL lets readers run alongside the writer, and
+# synchronous=NORMAL only fsyncs at checkpoints instead of on every commit.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA foreign_keys=ON",
+)
+
+# One shared connection per process, guarded by a lock. Async code reaches it through
+# run_in_db(), which hands the call to a single dedicated thread so SQLite work never
+# runs on the event loop.
+_connection = None
+_connection_lock = threading.RLock()
+_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
 def create_connection():
-    """Create a database connection to the SQLite database."""
-    return sqlite3.connect(DATABASE)
+    """Open a new database connection with the tuned pragmas applied."""
+    conn = sqlite3.connect(DATABASE, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get_connection():
+    """Return the shared database connection, opening it on first use."""
+    global _connection
+    with _connection_lock:
+        if _connection is None:
+            _connection = create_connection()
+        return _connection
+
+def close_connection():
+    """Close the shared database connection."""
+    global _connection
+    with _connection_lock:
+        if _connection is not None:
+            # Refresh query planner statistics for the indexes the workload actually used
+            _connection.execute("PRAGMA optimize")
+            _connection.close()
+            _connection = None
+
+@contextmanager
+def transaction(immediate=False):
+    """
+    Yield a cursor on the shared connection; commit on success, roll back on error.
+
+    With immediate=True the write lock is taken up front (BEGIN IMMEDIATE), making
+    read-then-write sequences and DDL atomic across processes.
+    """
+    with _connection_lock:
+        conn = get_connection()
+        cursor = conn.cursor()
+        try:
+            if immediate:
+                cursor.execute("BEGIN IMMEDIATE")
+            yield cursor
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+async def run_in_db(func, *args, **kwargs):
+    """Run a database function on the dedicated SQLite executor without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(func, *args, **kwargs))
 
 def create_tables():
     """Create the necessary tables in the database if they don't exist."""
-    conn = create_connection()
-    cursor = conn.cursor()
-    
-    # Table for storing posts fetched from the website
+    with transaction() as cursor:
+        # Table for storing posts fetched from the website
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_posts (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER,
+                name TEXT,
+                bp_media_id TEXT,
+                adventure_number TEXT,
+                adventure_level TEXT,
+                content_stripped TEXT,
+                post_timestamp TEXT,
+                activity_id INTEGER,
+                processed INTEGER DEFAULT 0
+            )
+        ''')
+
+        # Table for storing user history (processed post data)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                post_id INTEGER,
+                user_id INTEGER,
+                content TEXT,
+                adventure_name TEXT,
+                image_urls TEXT,
+                technical_analysis TEXT,
+                knowledge_history TEXT,
+                final_comment TEXT,
+                rating INTEGER,
+                post_date TEXT
+            )
+        ''')
+
+        # Table for storing the last fetch timestamp
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS fetch_timestamps (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                last_fetch TEXT
+            )
+        ''')
+
+    migrate()
+
+def _migration_1_hot_query_indexes(cursor):
+    """Index the columns the hot queries filter and sort on."""
+    # activity_id identifies a BuddyBoss activity; the unique index lets batch inserts
+    # deduplicate with ON CONFLICT. Drop duplicates left by older versions first.
+    cursor.execute("DELETE FROM user_posts WHERE activity_id IS NOT NULL AND id NOT IN (SELECT MIN(id) FROM user_posts GROUP BY activity_id)")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_user_posts_activity_id ON user_posts(activity_id)")
+    # Partial index: only the (small) unprocessed backlog is indexed
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_posts_unprocessed ON user_posts(id) WHERE processed = 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_posts_post_timestamp ON user_posts(post_timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_history_user_id ON user_history(user_id)")
+
+def _migration_2_fetch_cursor(cursor):
+    """Add the durable BuddyBoss fetch cursor."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fetch_cursor (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_activity_id INTEGER,
+            last_timestamp TEXT,
+            updated_at TEXT
+        )
+    ''')
+    # Start from the newest post already stored so upgraded databases don't refetch everything
+    cursor.execute('''
+        INSERT OR IGNORE INTO fetch_cursor (id, last_activity_id, last_timestamp, updated_at)
+        SELECT 1, activity_id, post_timestamp, ? FROM user_posts
+        WHERE post_timestamp IS NOT NULL AND post_timestamp != ''
+        ORDER BY post_timestamp DESC, activity_id DESC LIMIT 1
+    ''', (datetime.now(timezone.utc).isoformat(),))
+
+def _migration_3_user_history_summary(cursor):
+    """Add the rolling per-user history summary."""
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_posts (
-            id INTEGER PRIMARY KEY,
-            user_id INTEGER,
-            name TEXT,
-            bp_media_id TEXT,
-            adventure_number TEXT,
-            adventure_level TEXT,
-            content_stripped TEXT,
-            post_timestamp TEXT,
-            activity_id INTEGER,
-            processed INTEGER DEFAULT 0
+        CREATE TABLE IF NOT EXISTS user_history_summary (
+            user_id INTEGER PRIMARY KEY,
+            summary TEXT,
+            last_history_id INTEGER,
+            updated_at TEXT
         )
     ''')
-    
-    # Table for storing user history (processed post data)
+    # Build summaries for the history that already exists
+    cursor.execute("SELECT id, user_id, post_id, adventure_name, final_comment, rating, post_date FROM user_history ORDER BY id")
+    summaries = {}
+    for history_id, user_id, post_id, adventure_name, final_comment, rating, post_date in cursor.fetchall():
+        summaries[user_id] = (_fold_history_entry(summaries.get(user_id, (None,))[0], post_id, adventure_name, final_comment, rating, post_date), history_id)
+    now = datetime.now(timezone.utc).isoformat()
+    cursor.executemany(
+        "INSERT OR REPLACE INTO user_history_summary (user_id, summary, last_history_id, updated_at) VALUES (?, ?, ?, ?)",
+        [(user_id, json.dumps(summary), history_id, now) for user_id, (summary, history_id) in summaries.items()]
+    )
+
+def _migration_4_agent_cache(cursor):
+    """Add the persistent agent response cache."""
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_history (
+        CREATE TABLE IF NOT EXISTS agent_cache (
+            cache_key TEXT PRIMARY KEY,
+            agent TEXT,
+            response TEXT,
+            created_at REAL,
+            last_used_at REAL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_agent_cache_last_used_at ON agent_cache(last_used_at)")
+
+def _migration_5_post_jobs(cursor):
+    """Add the post processing job queue."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS post_jobs (
+            post_id INTEGER PRIMARY KEY,
+            state TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL,
+            lease_owner TEXT,
+            lease_expires_at REAL,
+            last_error TEXT,
+            updated_at REAL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_post_jobs_state_available_at ON post_jobs(state, available_at)")
+    now = time.time()
+    cursor.execute(
+        "INSERT OR IGNORE INTO post_jobs (post_id, state, available_at, updated_at) SELECT id, CASE WHEN processed = 1 THEN 'done' ELSE 'queued' END, ?, ? FROM user_posts",
+        (now, now)
+    )
+
+def _migration_6_post_traces(cursor):
+    """Add per-post processing traces."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS post_traces (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             post_id INTEGER,
-            user_id INTEGER,
-            content TEXT,
-            adventure_name TEXT,
-            image_urls TEXT,
-            technical_analysis TEXT,
-            knowledge_history TEXT,
-            final_comment TEXT,
-            rating INTEGER,
-            post_date TEXT
+            started_at REAL,
+            duration REAL,
+            status TEXT,
+            spans TEXT,
+            usage TEXT,
+            cost_usd REAL
         )
     ''')
-    
-    # Table for storing the last fetch timestamp
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_post_traces_post_id ON post_traces(post_id)")
+
+def _migration_7_vector_store_files(cursor):
+    """Add the persisted vector store file catalog."""
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS fetch_timestamps (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            last_fetch TEXT
+        CREATE TABLE IF NOT EXISTS vector_store_files (
+            vector_store_id TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            filename TEXT,
+            PRIMARY KEY (vector_store_id, file_id)
+        )
+    ''')
+
+def _migration_8_vector_store_versions(cursor):
+    """Add per-vector-store content versions for the agent cache key."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vector_store_versions (
+            vector_store_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
         )
     ''')
-    conn.commit()
-    conn.close()
+
+# Schema migrations, applied in order. The schema version is stored in PRAGMA user_version,
+# so existing databases are upgraded in place. Append new migrations; never reorder them.
+MIGRATIONS = [
+    _migration_1_hot_query_indexes,
+    _migration_2_fetch_cursor,
+    _migration_3_user_history_summary,
+    _migration_4_agent_cache,
+    _migration_5_post_jobs,
+    _migration_6_post_traces,
+    _migration_7_vector_store_files,
+    _migration_8_vector_store_versions,
+]
+
+def migrate():
+    """
+    Apply any pending schema migrations, each in its own BEGIN IMMEDIATE transaction that also
+    bumps user_version, so a failure keeps the migrations before it. The version is re-read
+    under the write lock, so concurrent processes never apply the same migration twice.
+    Returns the resulting schema version.
+    """
+    version = 0
+    for target_version, migration in enumerate(MIGRATIONS, start=1):
+        with transaction(immediate=True) as cursor:
+            cursor.execute("PRAGMA user_version")
+            version = cursor.fetchone()[0]
+            if target_version <= version:
+                continue
+            print(f"Applying database migration {target_version}: {migration.__doc__}")
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {target_version}")
+            version = target_version
+    return version
 
 def get_last_fetch_time():
     """Fetch the last fetch timestamp from the database."""
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT last_fetch FROM fetch_timestamps ORDER BY id DESC LIMIT 1")
-    result = cursor.fetchone()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute("SELECT last_fetch FROM fetch_timestamps ORDER BY id DESC LIMIT 1")
+        result = cursor.fetchone()
     return result[0] if result else "1970-01-01T00:00:00Z"
 
 def get_latest_post_timestamp():
     """Fetch the most recent post_timestamp from the user_posts table."""
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT post_timestamp FROM user_posts ORDER BY post_timestamp DESC LIMIT 1")
-    result = cursor.fetchone()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute("SELECT post_timestamp FROM user_posts ORDER BY post_timestamp DESC LIMIT 1")
+        result = cursor.fetchone()
     return result[0] if result else "1970-01-01T00:00:00Z"
 
 def insert_post(user_id, name, bp_media_id, adventure_number, adventure_level, content_stripped, post_timestamp, activity_id):
     """Insert a new post into the user_posts table if it doesn't already exist."""
-    conn = create_connection()
-    cursor = conn.cursor()
-    
-    # Check if the post already exists based on activity_id
-    cursor.execute("SELECT id FROM user_posts WHERE activity_id = ?", (activity_id,))
-    if cursor.fetchone():
-        conn.close()
-        print(f"Skipping duplicate post with activity_id {activity_id}")
-        return
-    
+    insert_posts([{
+        "user_id": user_id,
+        "name": name,
+        "bp_media_id": bp_media_id,
+        "adventure_number": adventure_number,
+        "adventure_level": adventure_level,
+        "content_stripped": content_stripped,
+        "timestamp": post_timestamp,
+        "activity_id": activity_id
+    }])
+
+def insert_posts(posts, advance_cursor=False):
+    """
+    Insert a batch of fetched posts (as returned by fetch_posts_from_website) in one transaction.
+
+    Posts whose activity_id is already stored are skipped via the unique index, and the fetch
+    timestamp is recorded once for the whole batch. With advance_cursor=True the fetch cursor
+    is moved to the newest post of the batch in the same transaction, so a page is either
+    stored and checkpointed or not at all. Returns the number of new posts inserted.
+    """
+    rows = [
+        (
+            post["user_id"],
+            post.get("name", f"User_{post['user_id']}"),
+            json.dumps(post["bp_media_id"]),
+            post["adventure_number"],
+            post["adventure_level"],
+            post["content_stripped"],
+            post["timestamp"],
+            post["activity_id"]
+        )
+        for post in posts
+    ]
+    with transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO user_posts (user_id, name, bp_media_id, adventure_number, adventure_level, content_stripped, post_timestamp, activity_id, processed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+            ON CONFLICT(activity_id) DO NOTHING
+        ''', rows)
+        inserted = max(cursor.rowcount, 0) if rows else 0
+        if inserted:
+            _enqueue_unprocessed_posts(cursor)
+
+        # Update the fetch timestamp
+        cursor.execute("INSERT INTO fetch_timestamps (last_fetch) VALUES (?)", (datetime.now(timezone.utc).isoformat(),))
+
+        if advance_cursor and posts:
+            newest = max(posts, key=lambda post: (post["timestamp"] or "", post["activity_id"] or 0))
+            _save_fetch_cursor(cursor, newest["activity_id"], newest["timestamp"])
+    return inserted
+
+def _save_fetch_cursor(cursor, activity_id, timestamp):
     cursor.execute('''
-        INSERT INTO user_posts (user_id, name, bp_media_id, adventure_number, adventure_level, content_stripped, post_timestamp, activity_id, processed)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
-    ''', (user_id, name, json.dumps(bp_media_id), adventure_number, adventure_level, content_stripped, post_timestamp, activity_id))
-    
-    # Update the fetch timestamp
-    cursor.execute("INSERT INTO fetch_timestamps (last_fetch) VALUES (?)", (datetime.now(timezone.utc).isoformat(),))
-    
-    conn.commit()
-    conn.close()
-
-# Other functions (get_unprocessed_posts, mark_post_processed, store_user_history, fetch_user_history) remain unchanged
-
-def get_unprocessed_posts():
-    """Retrieve all unprocessed posts from the user_posts table."""
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, user_id, name, bp_media_id, adventure_number, content_stripped, activity_id FROM user_posts WHERE processed = 0")
-    rows = cursor.fetchall()
-    conn.close()
+        INSERT INTO fetch_cursor (id, last_activity_id, last_timestamp, updated_at) VALUES (1, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET last_activity_id = excluded.last_activity_id, last_timestamp = excluded.last_timestamp, updated_at = excluded.updated_at
+        WHERE excluded.last_timestamp > fetch_cursor.last_timestamp
+           OR (excluded.last_timestamp = fetch_cursor.last_timestamp AND excluded.last_activity_id > fetch_cursor.last_activity_id)
+    ''', (activity_id, timestamp, datetime.now(timezone.utc).isoformat()))
+
+def get_fetch_cursor():
+    """Return the fetch cursor as (last_activity_id, last_timestamp), or None before the first fetch."""
+    with transaction() as cursor:
+        cursor.execute("SELECT last_activity_id, last_timestamp FROM fetch_cursor WHERE id = 1")
+        result = cursor.fetchone()
+    return (result[0], result[1]) if result else None
+
+def _enqueue_unprocessed_posts(cursor):
+    now = time.time()
+    cursor.execute(
+        "INSERT OR IGNORE INTO post_jobs (post_id, state, available_at, updated_at) SELECT id, 'queued', ?, ? FROM user_posts WHERE processed = 0",
+        (now, now)
+    )
+
+def _post_row(row):
     # Deserialize bp_media_id from JSON
-    return [(row[0], row[1], row[2], json.loads(row[3]) if row[3] else [], row[4], row[5], row[6]) for row in rows]
-
-def mark_post_processed(post_id):
-    """Mark a post as processed in the user_posts table."""
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE user_posts SET processed = 1 WHERE id = ?", (post_id,))
-    conn.commit()
-    conn.close()
-
-def store_user_history(post_id, user_id, content, adventure_name, image_urls, technical_analysis, knowledge_history, final_comment, rating, post_date):
-    """Store the processed post data in the user_history table."""
-    conn = create_connection()
-    cursor = conn.cursor()
+    return (row[0], row[1], row[2], json.loads(row[3]) if row[3] else [], row[4], row[5], row[6])
+
+# Jobs in these states (with available_at in the past) can be claimed; a leased job can be
+# reclaimed once its lease expires, e.g. after the worker holding it crashed.
+CLAIMABLE_JOBS = '''
+    (state IN ('queued', 'failed') AND available_at <= :now)
+    OR (state = 'leased' AND lease_expires_at <= :now)
+'''
+
+def claim_job(worker_id, lease_seconds):
+    """
+    Lease the next claimable post to `worker_id` for lease_seconds and return (post, attempt,
+    lease), or None when nothing is ready. `lease` is a token unique to this claim, which
+    renew_job_lease, complete_job and fail_job require, so a coroutine whose lease expired
+    can't touch a job that was reclaimed, even from the same process. BEGIN IMMEDIATE makes
+    the select-and-lease atomic, so concurrent workers and processes never claim the same job.
+    """
+    now = time.time()
+    with transaction(immediate=True) as cursor:
+        cursor.execute(f"SELECT post_id FROM post_jobs WHERE {CLAIMABLE_JOBS} ORDER BY available_at, post_id LIMIT 1", {"now": now})
+        job = cursor.fetchone()
+        if job is None:
+            return None
+        lease = f"{worker_id}:{uuid.uuid4().hex}"
+        cursor.execute(
+            "UPDATE post_jobs SET state = 'leased', attempts = attempts + 1, lease_owner = ?, lease_expires_at = ?, updated_at = ? WHERE post_id = ?",
+            (lease, now + lease_seconds, now, job[0])
+        )
+        cursor.execute("SELECT attempts FROM post_jobs WHERE post_id = ?", (job[0],))
+        attempt = cursor.fetchone()[0]
+        cursor.execute("SELECT id, user_id, name, bp_media_id, adventure_number, content_stripped, activity_id FROM user_posts WHERE id = ?", (job[0],))
+        row = cursor.fetchone()
+        if row is None:
+            # The post was deleted behind the queue's back; nothing left to process
+            cursor.execute("UPDATE post_jobs SET state = 'dead', last_error = 'Post no longer exists', lease_owner = NULL WHERE post_id = ?", (job[0],))
+            return None
+    return _post_row(row), attempt, lease
+
+def complete_job(post_id, lease, history=None):
+    """
+    Mark a post's job done and the post processed, storing `history` (_insert_user_history's
+    arguments) in the same transaction. Returns False, storing nothing, if `lease` is no
+    longer the job's current lease, so a reclaimed post is only recorded once.
+    """
+    with transaction(immediate=True) as cursor:
+        cursor.execute(
+            "UPDATE post_jobs SET state = 'done', lease_owner = NULL, lease_expires_at = NULL, last_error = NULL, updated_at = ? WHERE post_id = ? AND state = 'leased' AND lease_owner = ?",
+            (time.time(), post_id, lease)
+        )
+        if cursor.rowcount == 0:
+            return False
+        if history:
+            _insert_user_history(cursor, **history)
+        cursor.execute("UPDATE user_posts SET processed = 1 WHERE id = ?", (post_id,))
+    return True
+
+def renew_job_lease(post_id, lease, lease_seconds):
+    """Extend `lease` on a job by lease_seconds from now. Returns False if the lease was lost."""
+    now = time.time()
+    with transaction() as cursor:
+        cursor.execute(
+            "UPDATE post_jobs SET lease_expires_at = ?, updated_at = ? WHERE post_id = ? AND state = 'leased' AND lease_owner = ?",
+            (now + lease_seconds, now, post_id, lease)
+        )
+        return cursor.rowcount == 1
+
+def fail_job(post_id, lease, error, max_attempts, backoff_base_seconds, backoff_max_seconds):
+    """
+    Record a failed attempt. The job is retried after an exponential backoff, or moved to the
+    'dead' (dead-letter) state once it has used max_attempts. Returns the new state, or None
+    if `lease` is no longer the job's current lease.
+    """
+    now = time.time()
+    with transaction(immediate=True) as cursor:
+        cursor.execute("SELECT attempts FROM post_jobs WHERE post_id = ? AND state = 'leased' AND lease_owner = ?", (post_id, lease))
+        job = cursor.fetchone()
+        if job is None:
+            return None
+        attempts = job[0]
+        state = "dead" if attempts >= max_attempts else "failed"
+        delay = min(backoff_base_seconds * (2 ** (attempts - 1)), backoff_max_seconds)
+        cursor.execute(
+            "UPDATE post_jobs SET state = ?, available_at = ?, lease_owner = NULL, lease_expires_at = NULL, last_error = ?, updated_at = ? WHERE post_id = ?",
+            (state, now + delay, error[:2000], now, post_id)
+        )
+    return state
+
+def retry_dead_jobs():
+    """Move every dead-lettered job back to the queue with a fresh attempt count. Returns how many."""
+    now = time.time()
+    with transaction() as cursor:
+        cursor.execute("UPDATE post_jobs SET state = 'queued', attempts = 0, available_at = ?, updated_at = ? WHERE state = 'dead'", (now, now))
+        return cursor.rowcount
+
+def get_job_counts():
+    """Return the number of jobs per state, plus how many are claimable right now as 'ready'."""
+    with transaction() as cursor:
+        cursor.execute("SELECT state, COUNT(*) FROM post_jobs GROUP BY state")
+        counts = {"queued": 0, "leased": 0, "done": 0, "failed": 0, "dead": 0}
+        counts.update(dict(cursor.fetchall()))
+        cursor.execute(f"SELECT COUNT(*) FROM post_jobs WHERE {CLAIMABLE_JOBS}", {"now": time.time()})
+        counts["ready"] = cursor.fetchone()[0]
+    return counts
+
+def get_recent_processed_posts(limit):
+    """Retrieve the `limit` most recently stored posts that have been processed, newest first."""
+    with transaction() as cursor:
+        cursor.execute("SELECT id, user_id, name, bp_media_id, adventure_number, content_stripped, activity_id FROM user_posts WHERE processed = 1 ORDER BY id DESC LIMIT ?", (limit,))
+        rows = cursor.fetchall()
+    return [_post_row(row) for row in rows]
+
+# Bounds for the rolling history summary, so its size doesn't grow with submission count
+SUMMARY_MAX_NOTES = int(os.getenv("HISTORY_SUMMARY_MAX_NOTES", "10"))
+SUMMARY_MAX_ADVENTURES = int(os.getenv("HISTORY_SUMMARY_MAX_ADVENTURES", "30"))
+SUMMARY_NOTE_MAX_CHARS = 200
+
+def _condense(text, max_chars=SUMMARY_NOTE_MAX_CHARS):
+    """First sentence of `text`, cut to max_chars."""
+    text = " ".join((text or "").split())
+    first_sentence = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+    return first_sentence if len(first_sentence) <= max_chars else first_sentence[:max_chars - 1] + "…"
+
+def _fold_history_entry(summary, post_id, adventure_name, final_comment, rating, post_date):
+    """Return `summary` updated with one more history entry. Every field is bounded in size."""
+    summary = dict(summary or {"entries": 0, "rating_total": 0, "rated_entries": 0, "first_post_date": post_date, "adventures": {}, "notes": []})
+    summary["entries"] += 1
+    if rating is not None:
+        summary["rating_total"] += rating
+        summary["rated_entries"] += 1
+    summary["last_post_date"] = post_date
+
+    adventures = dict(summary["adventures"])
+    adventure = adventure_name or "Unknown"
+    adventures[adventure] = adventures.pop(adventure, 0) + 1  # Re-insert so the dict stays in recency order
+    while len(adventures) > SUMMARY_MAX_ADVENTURES:
+        adventures.pop(next(iter(adventures)))
+    summary["adventures"] = adventures
+
+    notes = summary["notes"] + [{"post_id": post_id, "adventure": adventure, "date": post_date, "note": _condense(final_comment)}]
+    summary["notes"] = notes[-SUMMARY_MAX_NOTES:]
+    return summary
+
+def _insert_user_history(cursor, post_id, user_id, content, adventure_name, image_urls, technical_analysis, knowledge_history, final_comment, rating, post_date):
+    """Insert a processed post into user_history and fold it into the user's rolling summary."""
     cursor.execute('''
         INSERT INTO user_history (post_id, user_id, content, adventure_name, image_urls, technical_analysis, knowledge_history, final_comment, rating, post_date)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', (post_id, user_id, content, adventure_name, json.dumps(image_urls), technical_analysis, knowledge_history, final_comment, rating, post_date))
-    conn.commit()
-    conn.close()
+    history_id = cursor.lastrowid
+
+    cursor.execute("SELECT summary FROM user_history_summary WHERE user_id = ?", (user_id,))
+    row = cursor.fetchone()
+    summary = _fold_history_entry(json.loads(row[0]) if row else None, post_id, adventure_name, final_comment, rating, post_date)
+    cursor.execute('''
+        INSERT INTO user_history_summary (user_id, summary, last_history_id, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET summary = excluded.summary, last_history_id = excluded.last_history_id, updated_at = excluded.updated_at
+    ''', (user_id, json.dumps(summary), history_id, datetime.now(timezone.utc).isoformat()))
+
+def fetch_user_history_summary(user_id):
+    """Fetch the rolling history summary for a user, or None if they have no history yet."""
+    with transaction() as cursor:
+        cursor.execute("SELECT summary FROM user_history_summary WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+    return json.loads(row[0]) if row else None
+
+def fetch_recent_user_history(user_id, limit):
+    """Fetch a user's `limit` most recent history entries, oldest first, in the fetch_user_history format."""
+    with transaction() as cursor:
+        cursor.execute("SELECT post_id, content, adventure_name, image_urls, technical_analysis, knowledge_history, final_comment, rating, post_date FROM user_history WHERE user_id = ? ORDER BY id DESC LIMIT ?", (user_id, limit))
+        rows = cursor.fetchall()
+    return [(row[0], row[1], row[2], json.loads(row[3]) if row[3] else [], row[4], row[5], row[6], row[7], row[8]) for row in reversed(rows)]
 
 def fetch_user_history(user_id):
     """Fetch the history of processed posts for a given user."""
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT post_id, content, adventure_name, image_urls, technical_analysis, knowledge_history, final_comment, rating, post_date FROM user_history WHERE user_id = ?", (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute("SELECT post_id, content, adventure_name, image_urls, technical_analysis, knowledge_history, final_comment, rating, post_date FROM user_history WHERE user_id = ?", (user_id,))
+        rows = cursor.fetchall()
     # Deserialize image_urls from JSON
-    return [(row[0], row[1], row[2], json.loads(row[3]) if row[3] else [], row[4], row[5], row[6], row[7], row[8]) for row in rows]
\ No newline at end of file
+    return [(row[0], row[1], row[2], json.loads(row[3]) if row[3] else [], row[4], row[5], row[6], row[7], row[8]) for row in rows]
+
+def get_cached_response(cache_key, ttl_seconds):
+    """Return the cached agent response for `cache_key` if it is younger than ttl_seconds, else None."""
+    now = time.time()
+    with transaction() as cursor:
+        cursor.execute("SELECT response, created_at FROM agent_cache WHERE cache_key = ?", (cache_key,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        if now - row[1] > ttl_seconds:
+            cursor.execute("DELETE FROM agent_cache WHERE cache_key = ?", (cache_key,))
+            return None
+        cursor.execute("UPDATE agent_cache SET last_used_at = ? WHERE cache_key = ?", (now, cache_key))
+    return row[0]
+
+def store_cached_response(cache_key, agent, response, max_entries):
+    """Store an agent response, then evict the least recently used entries beyond max_entries."""
+    now = time.time()
+    with transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO agent_cache (cache_key, agent, response, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(cache_key) DO UPDATE SET response = excluded.response, created_at = excluded.created_at, last_used_at = excluded.last_used_at
+        ''', (cache_key, agent, response, now, now))
+        cursor.execute(
+            "DELETE FROM agent_cache WHERE cache_key IN (SELECT cache_key FROM agent_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+            (max_entries,)
+        )
+
+def purge_expired_responses(ttl_seconds):
+    """Delete cached agent responses older than ttl_seconds. Returns the number deleted."""
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM agent_cache WHERE created_at < ?", (time.time() - ttl_seconds,))
+        return cursor.rowcount
+
+def store_post_trace(trace):
+    """Store one post's processing trace (as returned by metrics.finish_trace)."""
+    with transaction() as cursor:
+        cursor.execute(
+            "INSERT INTO post_traces (post_id, started_at, duration, status, spans, usage, cost_usd) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (trace["post_id"], trace["started_at"], trace["duration"], trace["status"], json.dumps(trace["spans"]), json.dumps(trace["usage"]), trace["cost_usd"])
+        )
+
+def fetch_post_traces(post_id):
+    """Fetch every stored trace for a post, newest first."""
+    with transaction() as cursor:
+        cursor.execute("SELECT post_id, started_at, duration, status, spans, usage, cost_usd FROM post_traces WHERE post_id = ? ORDER BY id DESC", (post_id,))
+        rows = cursor.fetchall()
+    return [
+        {"post_id": row[0], "started_at": row[1], "duration": row[2], "status": row[3], "spans": json.loads(row[4]), "usage": json.loads(row[5]), "cost_usd": row[6]}
+        for row in rows
+    ]
+
+def load_vector_store_files(vector_store_id):
+    """Return the persisted {file_id: filename} catalog of a vector store (empty if never listed)."""
+    with transaction() as cursor:
+        cursor.execute("SELECT file_id, filename FROM vector_store_files WHERE vector_store_id = ?", (vector_store_id,))
+        return dict(cursor.fetchall())
+
+def _bump_vector_store_version(cursor, vector_store_id):
+    cursor.execute(
+        "INSERT INTO vector_store_versions (vector_store_id, version) VALUES (?, 1) ON CONFLICT(vector_store_id) DO UPDATE SET version = version + 1",
+        (vector_store_id,)
+    )
+
+def _vector_store_version(cursor, vector_store_id):
+    cursor.execute("SELECT version FROM vector_store_versions WHERE vector_store_id = ?", (vector_store_id,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def load_vector_store_version(vector_store_id):
+    """Return a vector store's content version, 0 until its catalog first changes."""
+    with transaction() as cursor:
+        return _vector_store_version(cursor, vector_store_id)
+
+def replace_vector_store_files(vector_store_id, files):
+    """
+    Replace a vector store's persisted catalog with `files` ({file_id: filename}). Bumps the
+    store's version if its set of files changed. Returns the version.
+    """
+    with transaction() as cursor:
+        cursor.execute("SELECT file_id FROM vector_store_files WHERE vector_store_id = ?", (vector_store_id,))
+        if {row[0] for row in cursor.fetchall()} != set(files):
+            _bump_vector_store_version(cursor, vector_store_id)
+        cursor.execute("DELETE FROM vector_store_files WHERE vector_store_id = ?", (vector_store_id,))
+        cursor.executemany(
+            "INSERT INTO vector_store_files (vector_store_id, file_id, filename) VALUES (?, ?, ?)",
+            [(vector_store_id, file_id, filename) for file_id, filename in files.items()]
+        )
+        return _vector_store_version(cursor, vector_store_id)
+
+def save_vector_store_file(vector_store_id, file_id, filename):
+    """Add a file to a vector store's persisted catalog and bump the store's version. Returns the version."""
+    with transaction() as cursor:
+        cursor.execute(
+            "INSERT OR REPLACE INTO vector_store_files (vector_store_id, file_id, filename) VALUES (?, ?, ?)",
+            (vector_store_id, file_id, filename)
+        )
+        _bump_vector_store_version(cursor, vector_store_id)
+        return _vector_store_version(cursor, vector_store_id)
+
+def remove_vector_store_file(vector_store_id, file_id):
+    """Remove a file from a vector store's persisted catalog and bump the store's version. Returns the version."""
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM vector_store_files WHERE vector_store_id = ? AND file_id = ?", (vector_store_id, file_id))
+        _bump_vector_store_version(cursor, vector_store_id)
+        return _vector_store_version(cursor, vector_store_id)
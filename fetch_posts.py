@@ -1,76 +1,113 @@
-import requests
+import httpx
 import re
-from auth import get_jwt_token  # Import the function to get the token
+import os
+from datetime import datetime, timedelta
+from auth import authorized_request  # Sends with the shared JWT token, refreshing it on 401
+from metrics import span
 
 BASE_URL = "https://my.hairdressing.school/wp-json/buddyboss/v1/activity"  # Correct base URL for activity endpoint
+PER_PAGE = int(os.getenv("FETCH_PER_PAGE", "100"))
+MAX_PAGES = int(os.getenv("FETCH_MAX_PAGES", "1000"))  # Safety stop for a runaway pagination loop
 
-def fetch_posts_from_website(last_timestamp=None):
+def format_post(post):
+    """Convert a raw BuddyBoss activity into the post dictionary stored in user_posts."""
+    post_timestamp = post.get("date", "")
+    activity_id = post.get("id", 0)
+    user_id = post.get("user_id", 0)
+    content_dict = post.get("content", {})
+    content_stripped = post.get("content_stripped", content_dict.get("rendered", "") if isinstance(content_dict, dict) else str(content_dict))
+
+    if not isinstance(content_stripped, str):
+        content_stripped = ""
+
+    # Use bp_media_ids for the image URL if available
+    bp_media_id = ""
+    if "bp_media_ids" in post and post["bp_media_ids"] and isinstance(post["bp_media_ids"], list) and len(post["bp_media_ids"]) > 0:
+        bp_media_id = post["bp_media_ids"][0]["attachment_data"]["full"]
+    # No fallback to content.rendered to avoid picking up icons like star2.svg
+
+    adventure_match = re.search(r"Abenteuer (\d+)", content_stripped)
+    level_match = re.search(r"(Basic Cut|Advanced Cut)", content_stripped)
+    adventure_number = int(adventure_match.group(1)) if adventure_match else None
+    adventure_level = level_match.group(1) if level_match else "Unknown"
+
+    return {
+        "activity_id": activity_id,
+        "user_id": user_id,
+        "name": post.get("name"),
+        "bp_media_id": post.get("bp_media_ids", []),
+        "adventure_number": adventure_number,
+        "adventure_level": adventure_level,
+        "content_stripped": content_stripped,
+        "timestamp": post_timestamp
+    }
+
+def _after_param(timestamp):
+    """
+    BuddyBoss treats 'after' as strictly greater than, so activities sharing the cursor's
+    second could be skipped at a page boundary. Ask from one second earlier instead; the
+    overlap is filtered out by iter_post_pages and deduplicated on insert.
+    """
+    try:
+        return (datetime.fromisoformat(timestamp.replace("Z", "+00:00")) - timedelta(seconds=1)).isoformat()
+    except ValueError:
+        return timestamp
+
+async def iter_post_pages(cursor=None, per_page=PER_PAGE):
+    """
+    Walk the BuddyBoss activity feed oldest-first and yield one page of formatted posts at a time.
+
+    Args:
+        cursor (tuple): (last_activity_id, last_timestamp) of the newest post already stored.
+                        Only activities after it are returned. If None, walks the whole feed.
+        per_page (int): Activities requested per page.
+
+    Walking in ascending order means each yielded page only contains posts newer than every
+    page before it, so the caller can checkpoint the cursor after each page and a crash
+    mid-backfill resumes from the last stored page.
+    """
+    last_activity_id, last_timestamp = cursor if cursor else (None, None)
+    params = {"per_page": per_page, "order": "asc"}
+    if last_timestamp:
+        params["after"] = _after_param(last_timestamp)  # BuddyBoss API supports 'after' parameter for filtering
+
+    for page in range(1, MAX_PAGES + 1):
+        try:
+            # Pooled keep-alive connection; retries 429/5xx with backoff, raises for other 4xx/5xx
+            with span("fetch.page"):
+                response = await authorized_request("GET", BASE_URL, params={**params, "page": page})
+        except httpx.HTTPError as e:
+            raise Exception(f"Failed to fetch posts (page {page}): {str(e)}")
+
+        activities = response.json()
+        formatted_posts = []
+        for post in activities:
+            formatted = format_post(post)
+            # Skip anything at or before the cursor (the one-second overlap, or an API that ignores 'after')
+            if last_timestamp and formatted["timestamp"] and (formatted["timestamp"], formatted["activity_id"]) <= (last_timestamp, last_activity_id or 0):
+                continue
+            formatted_posts.append(formatted)
+
+        # Sort posts by timestamp to ensure chronological order
+        formatted_posts.sort(key=lambda x: (x["timestamp"], x["activity_id"]))
+        if formatted_posts:
+            yield formatted_posts
+
+        total_pages = response.headers.get("X-WP-TotalPages")
+        if len(activities) < per_page or (total_pages and page >= int(total_pages)):
+            return
+    print(f"Stopped paginating after {MAX_PAGES} pages; the next fetch continues from the cursor.")
+
+async def fetch_posts_from_website(last_timestamp=None):
     """
     Fetch posts from the BuddyBoss API that are newer than the given timestamp.
-    
+
     Args:
         last_timestamp (str): The latest post_timestamp from the database in ISO 8601 format.
                              If None, fetches all posts.
-    
+
     Returns:
-        list: A list of formatted post dictionaries.
+        list: A list of formatted post dictionaries, across all pages.
     """
-    # Get the JWT token dynamically
-    try:
-        token = get_jwt_token()
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Failed to obtain JWT token for API authentication: {e}")
-
-    headers = {"Authorization": f"Bearer {token}"}
-    params = {"per_page": 100}
-    if last_timestamp:
-        params["after"] = last_timestamp  # BuddyBoss API supports 'after' parameter for filtering
-
-    try:
-        response = requests.get(BASE_URL, headers=headers, params=params, timeout=10)
-        response.raise_for_status()  # Raises an exception for 4xx/5xx status codes
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Failed to fetch posts: {str(e)}")
-
-    posts = response.json()
-    formatted_posts = []
-    for post in posts:
-        # Extract post timestamp and skip if older than last_timestamp (fallback check)
-        post_timestamp = post.get("date", "")
-        if last_timestamp and post_timestamp and post_timestamp <= last_timestamp:
-            print(f"Skipping post with timestamp {post_timestamp} (older than {last_timestamp})")
-            continue
-
-        activity_id = post.get("id", 0)
-        user_id = post.get("user_id", 0)
-        content_dict = post.get("content", {})
-        content_stripped = post.get("content_stripped", content_dict.get("rendered", "") if isinstance(content_dict, dict) else str(content_dict))
-        
-        if not isinstance(content_stripped, str):
-            content_stripped = ""
-        
-        # Use bp_media_ids for the image URL if available
-        bp_media_id = ""
-        if "bp_media_ids" in post and post["bp_media_ids"] and isinstance(post["bp_media_ids"], list) and len(post["bp_media_ids"]) > 0:
-            bp_media_id = post["bp_media_ids"][0]["attachment_data"]["full"]
-        # No fallback to content.rendered to avoid picking up icons like star2.svg
-        
-        adventure_match = re.search(r"Abenteuer (\d+)", content_stripped)
-        level_match = re.search(r"(Basic Cut|Advanced Cut)", content_stripped)
-        adventure_number = int(adventure_match.group(1)) if adventure_match else None
-        adventure_level = level_match.group(1) if level_match else "Unknown"
-
-        formatted_posts.append({
-            "activity_id": activity_id,
-            "user_id": user_id,
-            "name": post.get("name"),
-            "bp_media_id": post.get("bp_media_ids", []),
-            "adventure_number": adventure_number,
-            "adventure_level": adventure_level,
-            "content_stripped": content_stripped,
-            "timestamp": post_timestamp
-        })
-    
-    # Sort posts by timestamp to ensure chronological order
-    formatted_posts.sort(key=lambda x: x["timestamp"])
-    return formatted_posts
+    cursor = (None, last_timestamp) if last_timestamp else None
+    return [post async for page in iter_post_pages(cursor) for post in page]
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import random
+import time
+
+# Configured polling interval, used while fetches keep coming back empty
+FETCH_INTERVAL_SECONDS = float(os.getenv("FETCH_INTERVAL_SECONDS", "3600"))
+# Shortest interval the scheduler speeds up to while fetches keep finding new posts
+FETCH_MIN_INTERVAL_SECONDS = float(os.getenv("FETCH_MIN_INTERVAL_SECONDS", "300"))
+# First retry delay after a failed fetch; doubles per consecutive failure
+FETCH_ERROR_BACKOFF_SECONDS = float(os.getenv("FETCH_ERROR_BACKOFF_SECONDS", "30"))
+FETCH_MAX_BACKOFF_SECONDS = float(os.getenv("FETCH_MAX_BACKOFF_SECONDS", "3600"))
+# Each delay is randomised by up to this fraction either way, so instances don't poll in lockstep
+FETCH_JITTER_RATIO = float(os.getenv("FETCH_JITTER_RATIO", "0.1"))
+
+class FetchScheduler:
+    """
+    Decides when the next BuddyBoss fetch runs.
+
+    The delay shrinks (halving, down to min_interval) while fetches find new posts and grows
+    back to the configured interval while they come back empty. Consecutive failures back
+    off exponentially instead. trigger() wakes the scheduler immediately, e.g. from the
+    webhook or the dashboard; triggers that arrive while a fetch is running are coalesced
+    into one follow-up fetch. External triggers can't skip an error backoff or fetch more
+    often than min_interval: one that arrives too soon after the last fetch is held until
+    min_interval has passed, and any more that arrive meanwhile are folded into it.
+    """
+
+    def __init__(self, interval, min_interval, error_backoff, max_backoff, jitter_ratio):
+        self.interval = interval
+        self.min_interval = min(min_interval, interval)
+        self.error_backoff = error_backoff
+        self.max_backoff = max_backoff
+        self.jitter_ratio = jitter_ratio
+        self.current_interval = interval
+        self.consecutive_errors = 0
+        self.next_fetch_at = None
+        self.last_fetch_at = None
+        self._triggered = asyncio.Event()
+        self._trigger_reason = None
+        self._deferred = None
+
+    def trigger(self, reason="manual", external=False):
+        """
+        Run the next fetch now instead of waiting for the schedule. An external trigger within
+        min_interval of the last fetch runs once min_interval has passed instead. External
+        triggers are refused during an error backoff (the retry is already scheduled); returns
+        False when it was refused.
+        """
+        if external:
+            if self.consecutive_errors:
+                return False
+            if self.last_fetch_at is not None:
+                hold = self.last_fetch_at + self.min_interval - time.monotonic()
+                if hold > 0:
+                    self._defer(reason, hold)
+                    return True
+        self._fire(reason)
+        return True
+
+    def _fire(self, reason):
+        self._trigger_reason = reason
+        self._triggered.set()
+
+    def _defer(self, reason, delay):
+        """Trigger a fetch after `delay` seconds, unless one is already pending."""
+        if self._deferred is not None:
+            return
+        self._deferred = asyncio.get_running_loop().call_later(delay, self._fire_deferred, reason)
+        fetch_at = time.time() + delay
+        if self.next_fetch_at is None or fetch_at < self.next_fetch_at:
+            self.next_fetch_at = fetch_at
+
+    def _fire_deferred(self, reason):
+        self._deferred = None
+        if not self.consecutive_errors:  # The fetch since failed; its backoff decides the retry
+            self._fire(reason)
+
+    def record_success(self, new_posts):
+        """Adapt the polling interval to whether the last fetch found anything."""
+        self.consecutive_errors = 0
+        if new_posts:
+            self.current_interval = max(self.min_interval, self.current_interval / 2)
+        else:
+            self.current_interval = min(self.interval, self.current_interval * 2)
+
+    def record_failure(self):
+        """Count a failed fetch. Returns the backoff delay before the next attempt (without jitter)."""
+        self.consecutive_errors += 1
+        return self._base_delay()
+
+    def _base_delay(self):
+        if self.consecutive_errors:
+            return min(self.error_backoff * (2 ** (self.consecutive_errors - 1)), self.max_backoff)
+        return self.current_interval
+
+    def next_delay(self):
+        delay = self._base_delay()
+        return delay * random.uniform(1 - self.jitter_ratio, 1 + self.jitter_ratio)
+
+    async def wait(self):
+        """Sleep until the next fetch is due or triggered. Returns what started it."""
+        delay = self.next_delay()
+        self.next_fetch_at = time.time() + delay
+        try:
+            await asyncio.wait_for(self._triggered.wait(), delay)
+            reason = self._trigger_reason
+        except TimeoutError:
+            reason = "schedule"
+        self._triggered.clear()
+        if self._deferred is not None:
+            # This fetch picks up whatever the held trigger was waiting for
+            self._deferred.cancel()
+            self._deferred = None
+        self.next_fetch_at = None
+        self.last_fetch_at = time.monotonic()
+        return reason
+
+    def status(self):
+        return {
+            "interval_seconds": round(self._base_delay()),
+            "consecutive_errors": self.consecutive_errors,
+            "next_fetch_at": self.next_fetch_at,
+        }
+
+fetch_scheduler = FetchScheduler(FETCH_INTERVAL_SECONDS, FETCH_MIN_INTERVAL_SECONDS, FETCH_ERROR_BACKOFF_SECONDS, FETCH_MAX_BACKOFF_SECONDS, FETCH_JITTER_RATIO)
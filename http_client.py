@@ -0,0 +1,99 @@
+import asyncio
+import random
+import os
+import httpx
+
+# Connection pool shared by every BuddyBoss/WordPress call, so TCP and TLS handshakes are
+# paid once per connection instead of once per request.
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))
+# Upper bound on requests in flight at once, to stay polite to the WordPress host
+MAX_CONCURRENCY = int(os.getenv("HTTP_MAX_CONCURRENCY", "8"))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+BACKOFF_BASE_SECONDS = float(os.getenv("HTTP_BACKOFF_BASE_SECONDS", "0.5"))
+BACKOFF_MAX_SECONDS = float(os.getenv("HTTP_BACKOFF_MAX_SECONDS", "30"))
+DEFAULT_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "10"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+_client = None
+_semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+def get_http_client():
+    """Return the shared pooled AsyncClient, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=DEFAULT_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS
+            ),
+            follow_redirects=True
+        )
+    return _client
+
+async def close_http_client():
+    """Close the shared client and its pooled connections."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _backoff_delay(attempt, response=None):
+    """Seconds to wait before retry `attempt`: Retry-After if the server sent one, else exponential backoff with jitter."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(float(retry_after), BACKOFF_MAX_SECONDS)
+            except ValueError:
+                pass
+    delay = min(BACKOFF_BASE_SECONDS * (2 ** attempt), BACKOFF_MAX_SECONDS)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+async def request(method, url, retry_unsafe=False, **kwargs):
+    """
+    Send an HTTP request through the shared pool and return the response.
+
+    Connection failures are always retried, since the request never reached the server.
+    Timeouts, 429 and 5xx responses are retried with backoff for idempotent methods, or for
+    any method when `retry_unsafe` is set (e.g. a login POST). Raises httpx.HTTPStatusError
+    for a final 4xx/5xx response and httpx.TransportError when retries are exhausted.
+    """
+    method = method.upper()
+    retryable = retry_unsafe or method in IDEMPOTENT_METHODS
+    for attempt in range(MAX_RETRIES + 1):
+        last_attempt = attempt == MAX_RETRIES
+        try:
+            async with _semaphore:
+                response = await get_http_client().request(method, url, **kwargs)
+        except httpx.ConnectError as e:
+            if last_attempt:
+                raise
+            print(f"Connection to {url} failed ({e}); retrying...")
+            await asyncio.sleep(_backoff_delay(attempt))
+            continue
+        except httpx.TransportError as e:
+            if last_attempt or not retryable:
+                raise
+            print(f"{method} {url} failed ({e}); retrying...")
+            await asyncio.sleep(_backoff_delay(attempt))
+            continue
+
+        if response.status_code in RETRY_STATUSES and retryable and not last_attempt:
+            delay = _backoff_delay(attempt, response)
+            print(f"{method} {url} returned {response.status_code}; retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+            continue
+        response.raise_for_status()
+        return response
+
+async def get(url, **kwargs):
+    return await request("GET", url, **kwargs)
+
+async def post(url, **kwargs):
+    return await request("POST", url, **kwargs)
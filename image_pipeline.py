@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import time
+import httpx
+import http_client
+from agents.runtime import get_client
+from metrics import span
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow images are deduplicated by content hash only and sent at full size
+    Image = None
+
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "image_cache")
+# The vision model fits images into 2048x2048 and then scales the short side down to 768px,
+# so anything larger only costs bytes and upload time.
+MAX_LONG_SIDE = int(os.getenv("IMAGE_MAX_LONG_SIDE", "2048"))
+MAX_SHORT_SIDE = int(os.getenv("IMAGE_MAX_SHORT_SIDE", "768"))
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+# Images whose perceptual hashes differ in at most this many bits count as duplicates
+DEDUPE_MAX_DISTANCE = int(os.getenv("IMAGE_DEDUPE_MAX_DISTANCE", "4"))
+# Upload images to OpenAI (purpose="vision") instead of letting it fetch the URL on every run
+UPLOAD_IMAGES = os.getenv("IMAGE_UPLOAD", "1") == "1"
+# Cached vision file IDs are checked with OpenAI again after this long, and re-uploaded if the file is gone
+FILE_REVALIDATE_SECONDS = float(os.getenv("IMAGE_FILE_REVALIDATE_SECONDS", "86400"))
+
+_upload_locks = {}
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def _cache_path(*parts):
+    return os.path.join(IMAGE_CACHE_DIR, *parts)
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(path, data):
+    # Write then rename, so a crash never leaves a half-written entry behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _dhash(image):
+    """64-bit difference hash: near-identical images (re-encoded, resized) get near-identical hashes."""
+    pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+def _downscale(data):
+    """Return (jpeg_bytes, dhash) for an image scaled to the resolution the vision model uses."""
+    image = Image.open(io.BytesIO(data)).convert("RGB")
+    width, height = image.size
+    scale = min(1, MAX_LONG_SIDE / max(width, height), MAX_SHORT_SIDE / min(width, height))
+    if scale < 1:
+        image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    return output.getvalue(), _dhash(image)
+
+def _store(url, data):
+    """Hash, downscale and write one downloaded image to the disk cache. Runs in a worker thread."""
+    content_hash = _sha256(data)
+    meta_path = _cache_path(f"{content_hash}.json")
+    meta = _read_json(meta_path)
+    if meta is None:
+        meta = {"hash": content_hash, "dhash": None, "original_bytes": len(data), "undecodable": False}
+        image_bytes, extension = data, os.path.splitext(url.split("?")[0])[1] or ".jpg"
+        if Image is not None:
+            try:
+                image_bytes, meta["dhash"] = _downscale(data)
+                extension = ".jpg"
+            except (OSError, Image.DecompressionBombError, ValueError) as e:
+                # Uploaded as is, it would fail the run; OpenAI gets the URL instead
+                print(f"Could not decode image {url}, sending its URL instead: {e}")
+                meta["undecodable"] = True
+        meta["filename"] = f"{content_hash}{extension}"
+        meta["bytes"] = len(image_bytes)
+        with open(_cache_path(meta["filename"]), "wb") as f:
+            f.write(image_bytes)
+        _write_json(meta_path, meta)
+    # Remember which content this URL resolved to, so later runs skip the download
+    _write_json(_cache_path("urls", f"{_sha256(url.encode('utf-8'))}.json"), {"url": url, "hash": content_hash})
+    return meta
+
+async def _load(url):
+    """Return the cached metadata for an image URL, downloading it on first use. None if it can't be fetched."""
+    entry = await asyncio.to_thread(_read_json, _cache_path("urls", f"{_sha256(url.encode('utf-8'))}.json"))
+    if entry:
+        meta = await asyncio.to_thread(_read_json, _cache_path(f"{entry['hash']}.json"))
+        if meta:
+            return meta
+    try:
+        with span("image.download"):
+            response = await http_client.get(url, timeout=30)
+    except httpx.HTTPError as e:
+        print(f"Failed to download image {url}: {e}")
+        return None
+    with span("image.downscale"):
+        meta = await asyncio.to_thread(_store, url, response.content)
+    print(f"Cached image {url}: {meta['original_bytes']} -> {meta['bytes']} bytes")
+    return meta
+
+def _file_id_fresh(meta):
+    return bool(meta.get("file_id")) and time.time() - meta.get("file_verified_at", 0) < FILE_REVALIDATE_SECONDS
+
+async def _revalidate(stored):
+    """Check that a cached file ID still exists; drop it if OpenAI no longer has the file."""
+    try:
+        await get_client().files.retrieve(file_id=stored["file_id"])
+    except Exception as e:
+        if getattr(e, "status_code", None) == 404:
+            print(f"Uploaded image {stored['file_id']} no longer exists, uploading {stored['filename']} again.")
+            stored.pop("file_id")
+            return
+        # Can't tell right now; keep using the ID and check again next time
+        print(f"Could not check uploaded image {stored['file_id']}: {e}")
+        return
+    stored["file_verified_at"] = time.time()
+
+async def _upload(meta):
+    """
+    Upload a cached image for vision use once and remember its file ID, checking every
+    FILE_REVALIDATE_SECONDS that the file still exists. Returns the file ID or None.
+    """
+    if _file_id_fresh(meta):
+        return meta["file_id"]
+    lock = _upload_locks.setdefault(meta["hash"], asyncio.Lock())
+    async with lock:
+        meta_path = _cache_path(f"{meta['hash']}.json")
+        stored = await asyncio.to_thread(_read_json, meta_path) or meta
+        if stored.get("file_id") and not _file_id_fresh(stored):
+            await _revalidate(stored)
+            await asyncio.to_thread(_write_json, meta_path, stored)
+        if not stored.get("file_id"):
+            try:
+                with open(_cache_path(stored["filename"]), "rb") as f:
+                    data = f.read()
+                with span("image.upload"):
+                    uploaded = await get_client().files.create(file=(stored["filename"], data), purpose="vision")
+            except Exception as e:
+                print(f"Failed to upload image {stored['filename']}, falling back to its URL: {e}")
+                return None
+            stored["file_id"] = uploaded.id
+            stored["file_verified_at"] = time.time()
+            await asyncio.to_thread(_write_json, meta_path, stored)
+        meta["file_id"] = stored["file_id"]
+        return meta["file_id"]
+
+def _is_duplicate(meta, kept):
+    for other in kept:
+        if meta["hash"] == other["hash"]:
+            return True
+        if meta["dhash"] is not None and other["dhash"] is not None and bin(meta["dhash"] ^ other["dhash"]).count("1") <= DEDUPE_MAX_DISTANCE:
+            return True
+    return False
+
+async def prepare_images(image_urls):
+    """
+    Turn a post's image URLs into message content parts for the Technical Agent.
+
+    All images are fetched concurrently (or read from the disk cache), duplicates are dropped
+    by content hash and perceptual hash, and the rest are downscaled and uploaded once as
+    `image_file` parts. An image that can't be downloaded, decoded or uploaded falls back to
+    an `image_url` part so OpenAI fetches it itself.
+    """
+    if not image_urls:
+        return []
+    os.makedirs(_cache_path("urls"), exist_ok=True)
+    metas = await asyncio.gather(*(_load(url) for url in image_urls))
+
+    selected, kept = [], []
+    for url, meta in zip(image_urls, metas):
+        if meta is None:
+            selected.append((url, None))
+        elif _is_duplicate(meta, kept):
+            print(f"Skipping duplicate image {url}")
+        else:
+            kept.append(meta)
+            selected.append((url, meta))
+
+    file_ids = await asyncio.gather(*(
+        _upload(meta) if meta and UPLOAD_IMAGES and not meta.get("undecodable") else asyncio.sleep(0)
+        for url, meta in selected
+    ))
+    parts = []
+    for (url, meta), file_id in zip(selected, file_ids):
+        if file_id:
+            parts.append({"type": "image_file", "image_file": {"file_id": file_id}})
+        else:
+            parts.append({"type": "image_url", "image_url": {"url": url}})
+    return parts
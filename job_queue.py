@@ -0,0 +1,42 @@
+import os
+import socket
+from database import run_in_db, claim_job, complete_job, renew_job_lease, fail_job, get_job_counts
+
+# Longer than any one stage of the agent chain; process_post renews the lease between stages
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "600"))
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE_SECONDS = float(os.getenv("JOB_BACKOFF_BASE_SECONDS", "60"))
+BACKOFF_MAX_SECONDS = float(os.getenv("JOB_BACKOFF_MAX_SECONDS", "3600"))
+
+# Identifies this process in lease tokens, so several instances can share one database
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+async def claim():
+    """
+    Lease the next ready post. Returns (post, attempt, lease) or None if the queue has nothing
+    ready; `lease` identifies this claim and must be passed to renew, complete and fail.
+    """
+    return await run_in_db(claim_job, WORKER_ID, LEASE_SECONDS)
+
+class LeaseLost(Exception):
+    """The lease on a post expired and another worker may have claimed it."""
+
+async def renew(post_id, lease):
+    """Extend a lease on a post. Raises LeaseLost if it is no longer the post's current lease."""
+    if not await run_in_db(renew_job_lease, post_id, lease, LEASE_SECONDS):
+        raise LeaseLost(f"Lease on Post ID {post_id} was lost")
+
+async def complete(post_id, lease, history=None):
+    """Complete a post's job, storing its history with it. Raises LeaseLost, storing nothing, if the lease was lost."""
+    if not await run_in_db(complete_job, post_id, lease, history):
+        raise LeaseLost(f"Lease on Post ID {post_id} was lost before it completed")
+
+async def fail(post_id, lease, error):
+    """Record a failed attempt; returns 'failed' (will be retried), 'dead' (dead-lettered) or None (lease lost)."""
+    state = await run_in_db(fail_job, post_id, lease, str(error), MAX_ATTEMPTS, BACKOFF_BASE_SECONDS, BACKOFF_MAX_SECONDS)
+    if state == "dead":
+        print(f"Post ID {post_id} failed {MAX_ATTEMPTS} times and was moved to the dead-letter queue.")
+    return state
+
+async def counts():
+    return await run_in_db(get_job_counts)
@@ -1,21 +1,37 @@
 import os
 import time
-import requests
 import logging
 import asyncio
 import json
+import hmac
+from collections import deque
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-from auth import verify_connection
-from database import create_tables, mark_post_processed, get_unprocessed_posts, insert_post, get_last_fetch_time, get_latest_post_timestamp, store_user_history, fetch_user_history
-from fetch_posts import fetch_posts_from_website
+from auth import verify_connection, get_jwt_token, token_manager
+from http_client import close_http_client
+from database import run_in_db, close_connection, create_tables, insert_posts, get_fetch_cursor, purge_expired_responses, retry_dead_jobs, fetch_user_history, store_post_trace, fetch_post_traces, get_recent_processed_posts
+from fetch_posts import iter_post_pages
+from fetch_scheduler import fetch_scheduler
+from image_pipeline import prepare_images
+import job_queue
+from rate_limit import TokenBucket
+import metrics
+from metrics import span, start_trace, finish_trace
 from agents.technical_agent import get_technical_feedback
 from agents.wissens_historik_agent import get_historical_feedback
 from agents.meta_agent import get_final_comment
+from agents import technical_agent, wissens_historik_agent, meta_agent
 from buddyboss_client import BuddyBossClient
-from openai import OpenAI
+from agents.registry import registry
+from agents.catalog import catalog
+from agents.runtime import get_client, cancel_all_runs
+from agents.cache import get_cache_stats, CACHE_TTL_SECONDS
+from agents.governor import governor
+from broadcast import hub
+from ws_router import MessageRouter
 from dotenv import load_dotenv
-from fastapi import FastAPI, WebSocket, Request
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, WebSocket, Request, UploadFile, File, Form
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 
@@ -35,9 +51,6 @@ for handler in logger.handlers:
         defaults={"post_id": "N/A", "agent": "Unknown"}
     ))
 
-# OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 # Vector Store IDs
 ADVANCED_VECTOR_STORE_ID = os.getenv("ADVANCED_VECTOR_STORE_ID")
 BASIC_VECTOR_STORE_ID = os.getenv("BASIC_VECTOR_STORE_ID")
@@ -62,14 +75,93 @@ META_AGENT_PROMPT = """
 You are a Meta Agent. Your role is to combine technical and historical feedback...
 """
 
-# WebSocket clients
-connected_clients = set()
-
 # Store the current post for reprocessing
 current_post_data = None
 
+# Batch processing: number of posts processed concurrently by the worker pool
+PROCESS_CONCURRENCY = int(os.getenv("PROCESS_CONCURRENCY", "4"))
+# Upper bound on the concurrency a dashboard client may ask a batch to run with
+MAX_PROCESS_CONCURRENCY = int(os.getenv("MAX_PROCESS_CONCURRENCY", "32"))
+batch_task = None  # Running process_backlog task, if any
+
+# Autonomous mode: process queued posts as soon as ingestion stores them, without anyone
+# clicking through the dashboard.
+AUTO_PROCESS = os.getenv("AUTO_PROCESS", "0") == "1"
+AUTO_MAX_IN_FLIGHT = int(os.getenv("AUTO_MAX_IN_FLIGHT", str(PROCESS_CONCURRENCY)))
+# Each post costs three assistant runs; size this to the OpenAI rate limit tier
+AUTO_POSTS_PER_MINUTE = float(os.getenv("AUTO_POSTS_PER_MINUTE", "6"))
+# How often an idle loop re-checks the queue for retries whose backoff has expired
+AUTO_IDLE_POLL_SECONDS = float(os.getenv("AUTO_IDLE_POLL_SECONDS", "60"))
+# With AUTO_PROCESS, ingestion is held back while the ready backlog or the recent failure rate is above these
+BACKPRESSURE_MAX_BACKLOG = int(os.getenv("BACKPRESSURE_MAX_BACKLOG", "100"))
+BACKPRESSURE_MAX_ERROR_RATE = float(os.getenv("BACKPRESSURE_MAX_ERROR_RATE", "0.5"))
+BACKPRESSURE_ERROR_WINDOW = 20
+
+if AUTO_PROCESS and AUTO_POSTS_PER_MINUTE <= 0:
+    raise ValueError(f"AUTO_POSTS_PER_MINUTE must be greater than 0 when AUTO_PROCESS=1 (got {AUTO_POSTS_PER_MINUTE}).")
+
+post_rate_limiter = TokenBucket(AUTO_POSTS_PER_MINUTE / 60, max(1, AUTO_MAX_IN_FLIGHT))
+recent_outcomes = deque(maxlen=BACKPRESSURE_ERROR_WINDOW)  # True/False per processed post, newest last
+new_jobs = asyncio.Event()  # Set by ingestion when it stores new posts
+auto_process_task = None
+
+# Nothing touches the network at import time. Authentication, the OpenAI client and the
+# assistant configuration are set up by warm_up() in the background after the server
+# starts (or lazily on first use); /ready reports how far it has got.
+WARM_UP_RETRY_SECONDS = int(os.getenv("WARM_UP_RETRY_SECONDS", "30"))
+readiness = {"database": "pending", "buddyboss_auth": "pending", "openai": "pending", "assistants": "pending"}
+
+async def _warm_up_openai():
+    get_client()
+
+async def _warm_up_assistants():
+    agent_ids = [technical_agent.TECHNICAL_AGENT_ID, wissens_historik_agent.KNOWLEDGE_HISTORIK_AGENT_ID, meta_agent.META_AGENT_ID]
+    await asyncio.gather(*(registry.get(agent_id) for agent_id in agent_ids if agent_id))
+
+WARM_UP_STEPS = {
+    "database": lambda: run_in_db(create_tables),
+    "buddyboss_auth": get_jwt_token,
+    "openai": _warm_up_openai,
+    "assistants": _warm_up_assistants,
+}
+
+async def _warm_up_step(name, step):
+    while True:
+        try:
+            await step()
+            readiness[name] = "ready"
+            print(f"Warm-up: {name} ready.")
+            return
+        except Exception as e:
+            readiness[name] = f"error: {e}"
+            print(f"Warm-up: {name} failed ({e}). Retrying in {WARM_UP_RETRY_SECONDS} seconds...")
+            logging.error(f"Warm-up step {name} failed: {e}")
+            await asyncio.sleep(WARM_UP_RETRY_SECONDS)
+
+async def warm_up():
+    """Initialise every lazily created dependency in the background, retrying failures."""
+    await asyncio.gather(*(_warm_up_step(name, step) for name, step in WARM_UP_STEPS.items()))
+
+@asynccontextmanager
+async def lifespan(app):
+    global auto_process_task
+    warm_up_task = asyncio.create_task(warm_up())
+    if AUTO_PROCESS:
+        auto_process_task = asyncio.create_task(auto_process_loop())
+    yield
+    warm_up_task.cancel()
+    if auto_process_task:
+        auto_process_task.cancel()
+    for task in list(router.running):
+        task.cancel()
+    # Don't leave assistant runs burning tokens after the server stops
+    await cancel_all_runs()
+    await token_manager.close()
+    await close_http_client()
+    await run_in_db(close_connection)
+
 # FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Mount the static directory at /static
 app.mount("/static", StaticFiles(directory="static", html=True), name="static")
@@ -83,263 +175,612 @@ async def serve_index():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check():
+    ready = all(state == "ready" for state in readiness.values())
+    return JSONResponse({"status": "ready" if ready else "starting", "components": readiness}, status_code=200 if ready else 503)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus scrape endpoint: span latencies, token usage and cost, plus queue and rate-limit state."""
+    job_counts = await job_queue.counts()
+    gauges = {
+        "post_jobs": {(("state", state),): count for state, count in job_counts.items()},
+        "openai_tpm_available": round(governor.tokens.available()),
+        "websocket_clients": len(hub),
+    }
+    counters = {
+        "openai_http_requests": governor.stats["requests"],
+        "openai_http_retries": governor.stats["retries"],
+        "openai_rate_limited_responses": governor.stats["rate_limited"],
+    }
+    return PlainTextResponse(metrics.render(gauges, counters), media_type="text/plain; version=0.0.4")
+
+@app.get("/traces/{post_id}")
+async def post_traces(post_id: int):
+    """Every stored processing trace for a post, newest first."""
+    return await run_in_db(fetch_post_traces, post_id)
+
+# Files sent to OpenAI at once by /upload. Each upload streams from its spooled temp file,
+# so memory stays bounded whatever the file sizes.
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "3"))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(512 * 1024 * 1024)))  # OpenAI's per-file limit
+
+@app.post("/upload")
+async def upload_files(vector_store_type: str = Form(...), files: list[UploadFile] = File(...)):
+    """
+    Upload one or more reference documents and attach them to a vector store as one batch.
+
+    The multipart body is spooled to temp files by Starlette (in memory only while small) and
+    each file is streamed from there to the OpenAI files API. Progress is pushed to the
+    dashboard as upload_progress messages.
+    """
+    if vector_store_type not in ("advanced", "basic"):
+        return JSONResponse({"error": "vector_store_type must be 'advanced' or 'basic'."}, status_code=400)
+    vector_store_id = ADVANCED_VECTOR_STORE_ID if vector_store_type == 'advanced' else BASIC_VECTOR_STORE_ID
+    total = len(files)
+    uploaded, failed = [], []
+    semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+    async def report(file_name, status, **details):
+        await send_update_to_clients({"upload_progress": {
+            "file": file_name, "status": status, "done": len(uploaded) + len(failed), "total": total, **details
+        }})
+
+    async def upload(upload_file):
+        file_name = os.path.basename(upload_file.filename or "upload")
+        if upload_file.size is not None and upload_file.size > MAX_UPLOAD_BYTES:
+            failed.append({"name": file_name, "error": f"File is larger than {MAX_UPLOAD_BYTES} bytes."})
+            await report(file_name, "failed")
+            return
+        async with semaphore:
+            await report(file_name, "uploading")
+            try:
+                with span("upload.file"):
+                    file_obj = await get_client().files.create(file=(file_name, upload_file.file), purpose="assistants")
+                uploaded.append({"id": file_obj.id, "name": file_name})
+                await report(file_name, "uploaded")
+            except Exception as e:
+                print(f"Error uploading file {file_name}: {e}")
+                failed.append({"name": file_name, "error": str(e)})
+                await report(file_name, "failed")
+            finally:
+                await upload_file.close()
+
+    await asyncio.gather(*(upload(upload_file) for upload_file in files))
+
+    batch = None
+    if uploaded:
+        await send_update_to_clients({"upload_progress": {"status": "attaching", "done": total, "total": total}})
+        try:
+            with span("upload.attach_batch"):
+                batch = await get_client().vector_stores.file_batches.create_and_poll(
+                    vector_store_id=vector_store_id,
+                    file_ids=[file["id"] for file in uploaded]
+                )
+            registry.invalidate()
+            for file in uploaded:
+                await catalog.add(vector_store_id, file["id"], file["name"])
+            print(f"Attached {len(uploaded)} files to vector store {vector_store_id}: {batch.status} {batch.file_counts}")
+        except Exception as e:
+            print(f"Error attaching files to vector store {vector_store_id}: {e}")
+            await send_update_to_clients({"error": f"Failed to attach uploaded files: {str(e)}"})
+            return JSONResponse({"uploaded": uploaded, "failed": failed, "error": str(e)}, status_code=502)
+        await send_vector_store_files()
+
+    result = {
+        "uploaded": uploaded,
+        "failed": failed,
+        "batch": {"status": batch.status, "file_counts": batch.file_counts.model_dump()} if batch else None
+    }
+    await send_update_to_clients({"upload_complete": result})
+    return JSONResponse(result, status_code=200 if uploaded or not failed else 502)
+
+# Shared secret for POST /fetch; when unset the endpoint is disabled
+FETCH_TRIGGER_SECRET = os.getenv("FETCH_TRIGGER_SECRET")
+
+@app.post("/fetch")
+async def trigger_fetch(request: Request):
+    """Start a BuddyBoss fetch now, e.g. from a WordPress activity webhook or a cron job."""
+    if not FETCH_TRIGGER_SECRET:
+        return JSONResponse({"error": "Fetch triggers are disabled; set FETCH_TRIGGER_SECRET to enable them."}, status_code=403)
+    provided = request.headers.get("X-Fetch-Secret") or request.query_params.get("secret") or ""
+    if not hmac.compare_digest(provided, FETCH_TRIGGER_SECRET):
+        return JSONResponse({"error": "Invalid fetch trigger secret."}, status_code=403)
+    if not fetch_scheduler.trigger(request.query_params.get("source", "webhook"), external=True):
+        # Backing off after failures: the scheduled retry stays in charge
+        return JSONResponse({"status": "deferred", **fetch_scheduler.status()}, status_code=429)
+    # Runs now, or once FETCH_MIN_INTERVAL_SECONDS have passed since the last fetch
+    return JSONResponse({"status": "scheduled", **fetch_scheduler.status()}, status_code=202)
+
+# Dashboard requests of one type allowed to run at once, across all connections
+WS_PREVIEW_CONCURRENCY = int(os.getenv("WS_PREVIEW_CONCURRENCY", "2"))
+WS_QUERY_CONCURRENCY = int(os.getenv("WS_QUERY_CONCURRENCY", "4"))
+# Recent posts a batch prompt comparison may cover, and how many of them run at once
+PREVIEW_BATCH_MAX_POSTS = int(os.getenv("PREVIEW_BATCH_MAX_POSTS", "10"))
+PREVIEW_BATCH_CONCURRENCY = int(os.getenv("PREVIEW_BATCH_CONCURRENCY", "2"))
+
+router = MessageRouter()
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    global TECHNICAL_AGENT_PROMPT, KNOWLEDGE_HISTORIK_PROMPT, META_AGENT_PROMPT, current_post_data
-
+    """
+    Decode each dashboard message and hand it to the router, which runs it as its own task.
+    The receive loop never waits on a handler, so a long preview doesn't hold up the rest.
+    """
     await websocket.accept()
-    connected_clients.add(websocket)
+    hub.register(websocket)
+    connection = router.connection(websocket)
     try:
         while True:
+            message = await websocket.receive_text()
             try:
-                message = await websocket.receive_text()
                 data = json.loads(message)
-                if data['type'] == 'initial_data':
-                    history = fetch_user_history(311)
-                    if history:
-                        post_id, content, adventure_name, image_urls, technical_analysis, knowledge_history, final_comment, rating, post_date = history[-1]
-                        response = {
-                            "user_id": "311",
-                            "user_name": "Dilaur",
-                            "adventure_number": adventure_name.split()[-1] if adventure_name else "Unknown",
-                            "image_urls": image_urls if image_urls else [],
-                            "technical_input": content,
-                            "technical_feedback": technical_analysis,
-                            "technical_prompt": TECHNICAL_AGENT_PROMPT,
-                            "historical_input": f"User ID: 311",
-                            "historical_feedback": knowledge_history,
-                            "historical_prompt": KNOWLEDGE_HISTORIK_PROMPT,
-                            "meta_input": f"Technical Feedback: {technical_analysis}\nHistorical Feedback: {knowledge_history}",
-                            "meta_feedback": final_comment,
-                            "meta_prompt": META_AGENT_PROMPT
-                        }
-                        await websocket.send_json(response)
-                elif data['type'] == 'update_prompt':
-                    agent = data['agent']
-                    new_prompt = data['prompt']
-                    try:
-                        if agent == 'technical':
-                            TECHNICAL_AGENT_PROMPT = new_prompt
-                            client.beta.assistants.update(assistant_id=TECHNICAL_AGENT_ID, instructions=new_prompt)
-                        elif agent == 'historical':
-                            KNOWLEDGE_HISTORIK_PROMPT = new_prompt
-                            client.beta.assistants.update(assistant_id=KNOWLEDGE_HISTORIK_AGENT_ID, instructions=new_prompt)
-                        elif agent == 'meta':
-                            META_AGENT_PROMPT = new_prompt
-                            client.beta.assistants.update(assistant_id=META_AGENT_ID, instructions=new_prompt)
-                        print(f"Updated {agent} prompt: {new_prompt}")
-                    except Exception as e:
-                        print(f"Error updating prompt for {agent}: {e}")
-                        await websocket.send_json({"error": f"Failed to update prompt for {agent}: {str(e)}"})
-                elif data['type'] == 'process_next_post':
-                    unprocessed_posts = get_unprocessed_posts()
-                    if unprocessed_posts:
-                        await process_post(unprocessed_posts[0], BuddyBossClient())
-                    else:
-                        await send_update_to_clients({"message": "No unprocessed posts available."})
-                elif data['type'] == 'reprocess_current_post':
-                    if current_post_data:
-                        post = current_post_data['post']
-                        buddyboss_client = BuddyBossClient()
-                        await process_post(post, buddyboss_client, reprocess=True)
-                    else:
-                        await send_update_to_clients({"message": "No current post available to reprocess."})
-                elif data['type'] == 'preview_prompt_response':
-                    agent = data['agent']
-                    new_prompt = data['prompt']
-                    if not current_post_data:
-                        await send_update_to_clients({"message": "No current post available to preview."})
-                        continue
-
-                    post = current_post_data['post']
-                    post_id, user_id, user_name, bp_media_id, adventure_number, content_stripped, activity_id = post
-                    log_extra = {"post_id": post_id, "agent": ""}
-
-                    try:
-                        image_urls = []
-                        if isinstance(bp_media_id, list):
-                            for media in bp_media_id:
-                                if "attachment_data" in media and isinstance(media["attachment_data"], dict):
-                                    attachment_data = media["attachment_data"]
-                                    if "media_theatre_popup" in attachment_data and isinstance(attachment_data["media_theatre_popup"], str) and attachment_data["media_theatre_popup"].startswith("http"):
-                                        image_urls.append(attachment_data["media_theatre_popup"])
-                                        continue
-                                if "url" in media and isinstance(media["url"], str) and media["url"].startswith("http"):
-                                    image_urls.append(media["url"])
-                                else:
-                                    logging.warning(f"Invalid or missing URL in bp_media_id for Post ID {post_id}: {media}", extra=log_extra)
-                        else:
-                            if bp_media_id and isinstance(bp_media_id, str) and bp_media_id.startswith("http"):
-                                image_urls = [bp_media_id]
-                            else:
-                                print(f"Skipping image analysis for Post ID {post_id}: No valid image URL.")
-                                logging.info(f"Skipping image analysis due to invalid or missing image URL: {bp_media_id}", extra={**log_extra, "agent": "Process"})
-
-                        content_lower = (content_stripped or "").lower()
-                        adventure_lower = (adventure_number or "").lower()
-                        is_advanced = "advanced cut" in content_lower or "advanced" in content_lower or "advanced cut" in adventure_lower or "advanced" in adventure_lower
-                        vector_store_id = ADVANCED_VECTOR_STORE_ID if is_advanced else BASIC_VECTOR_STORE_ID
-                        vector_store_used = "Advanced Cut" if is_advanced else "Basic Cut"
-
-                        if agent == 'technical':
-                            original_prompt = TECHNICAL_AGENT_PROMPT
-                            client.beta.assistants.update(assistant_id=TECHNICAL_AGENT_ID, instructions=new_prompt)
-                            technical_feedback, detected_adventure_number = get_technical_feedback(image_urls[0] if image_urls else None, vector_store_id, content_stripped)
-                            client.beta.assistants.update(assistant_id=TECHNICAL_AGENT_ID, instructions=original_prompt)  # Revert to original prompt
-                            await send_update_to_clients({"preview_response": {"agent": "technical", "feedback": technical_feedback}})
-                        elif agent == 'historical':
-                            original_prompt = KNOWLEDGE_HISTORIK_PROMPT
-                            client.beta.assistants.update(assistant_id=KNOWLEDGE_HISTORIK_AGENT_ID, instructions=new_prompt)
-                            historical_feedback = get_historical_feedback(user_id, vector_store_id)
-                            client.beta.assistants.update(assistant_id=KNOWLEDGE_HISTORIK_AGENT_ID, instructions=original_prompt)  # Revert to original prompt
-                            await send_update_to_clients({"preview_response": {"agent": "historical", "feedback": historical_feedback}})
-                        elif agent == 'meta':
-                            original_prompt = META_AGENT_PROMPT
-                            client.beta.assistants.update(assistant_id=META_AGENT_ID, instructions=new_prompt)
-                            # For meta agent preview, we need technical and historical feedback first
-                            technical_feedback, _ = get_technical_feedback(image_urls[0] if image_urls else None, vector_store_id, content_stripped)
-                            historical_feedback = get_historical_feedback(user_id, vector_store_id)
-                            final_comment = get_final_comment(technical_feedback, historical_feedback)
-                            client.beta.assistants.update(assistant_id=META_AGENT_ID, instructions=original_prompt)  # Revert to original prompt
-                            await send_update_to_clients({"preview_response": {"agent": "meta", "feedback": final_comment}})
-                    except Exception as e:
-                        print(f"Error previewing prompt response for {agent} on Post ID {post_id}: {e}")
-                        await send_update_to_clients({"error": f"Failed to preview prompt response: {str(e)}"})
-                elif data['type'] == 'get_vector_store_files':
-                    try:
-                        advanced_files = client.vector_stores.files.list(vector_store_id=ADVANCED_VECTOR_STORE_ID)
-                        basic_files = client.vector_stores.files.list(vector_store_id=BASIC_VECTOR_STORE_ID)
-                        advanced_file_list = [{"id": file.id, "name": client.files.retrieve(file_id=file.id).filename} for file in advanced_files.data]
-                        basic_file_list = [{"id": file.id, "name": client.files.retrieve(file_id=file.id).filename} for file in basic_files.data]
-                        await send_update_to_clients({
-                            "advanced_vector_store_files": advanced_file_list,
-                            "basic_vector_store_files": basic_file_list
-                        })
-                    except Exception as e:
-                        print(f"Error fetching vector store files: {e}")
-                        await websocket.send_json({"error": f"Failed to fetch vector store files: {str(e)}"})
-                elif data['type'] == 'delete_vector_store_file':
-                    file_id = data['file_id']
-                    vector_store_type = data['vector_store_type']
-                    vector_store_id = ADVANCED_VECTOR_STORE_ID if vector_store_type == 'advanced' else BASIC_VECTOR_STORE_ID
-                    try:
-                        client.vector_stores.files.delete(vector_store_id=vector_store_id, file_id=file_id)
-                        print(f"Deleted file {file_id} from vector store {vector_store_id}")
-                        advanced_files = client.vector_stores.files.list(vector_store_id=ADVANCED_VECTOR_STORE_ID)
-                        basic_files = client.vector_stores.files.list(vector_store_id=BASIC_VECTOR_STORE_ID)
-                        advanced_file_list = [{"id": file.id, "name": client.files.retrieve(file_id=file.id).filename} for file in advanced_files.data]
-                        basic_file_list = [{"id": file.id, "name": client.files.retrieve(file_id=file.id).filename} for file in basic_files.data]
-                        await send_update_to_clients({
-                            "advanced_vector_store_files": advanced_file_list,
-                            "basic_vector_store_files": basic_file_list
-                        })
-                    except Exception as e:
-                        print(f"Error deleting vector store file {file_id}: {e}")
-                        await websocket.send_json({"error": f"Failed to delete vector store file: {str(e)}"})
-                elif data['type'] == 'upload_file':
-                    file_content = data['file_content']
-                    file_name = data['file_name']
-                    vector_store_type = data['vector_store_type']
-                    vector_store_id = ADVANCED_VECTOR_STORE_ID if vector_store_type == 'advanced' else BASIC_VECTOR_STORE_ID
-                    try:
-                        with open(file_name, "wb") as f:
-                            f.write(bytes.fromhex(file_content))
-                        file_obj = client.files.create(file=open(file_name, "rb"), purpose="assistants")
-                        client.vector_stores.files.create(vector_store_id=vector_store_id, file_id=file_obj.id)
-                        os.remove(file_name)
-                        print(f"Uploaded {file_name} to vector store {vector_store_id}")
-                        advanced_files = client.vector_stores.files.list(vector_store_id=ADVANCED_VECTOR_STORE_ID)
-                        basic_files = client.vector_stores.files.list(vector_store_id=BASIC_VECTOR_STORE_ID)
-                        advanced_file_list = [{"id": file.id, "name": client.files.retrieve(file_id=file.id).filename} for file in advanced_files.data]
-                        basic_file_list = [{"id": file.id, "name": client.files.retrieve(file_id=file.id).filename} for file in basic_files.data]
-                        await send_update_to_clients({
-                            "advanced_vector_store_files": advanced_file_list,
-                            "basic_vector_store_files": basic_file_list
-                        })
-                    except Exception as e:
-                        print(f"Error uploading file {file_name} to vector store: {e}")
-                        await websocket.send_json({"error": f"Failed to upload file: {str(e)}"})
+                connection.dispatch(data)
             except Exception as e:
                 print(f"Error handling WebSocket message: {e}")
                 logging.error(f"Error handling WebSocket message: {e}")
-                await websocket.send_json({"error": f"WebSocket message error: {str(e)}"})
+                hub.send(websocket, {"error": f"WebSocket message error: {str(e)}"})
     except Exception as e:
         print(f"WebSocket connection closed: {e}")
         logging.info(f"WebSocket connection closed: {e}")
     finally:
-        connected_clients.remove(websocket)
+        connection.close()
+        hub.unregister(websocket)
+
+@router.route("initial_data", limit=WS_QUERY_CONCURRENCY)
+async def handle_initial_data(request):
+    history = await run_in_db(fetch_user_history, 311)
+    if history:
+        post_id, content, adventure_name, image_urls, technical_analysis, knowledge_history, final_comment, rating, post_date = history[-1]
+        request.reply({
+            "user_id": "311",
+            "user_name": "Dilaur",
+            "adventure_number": adventure_name.split()[-1] if adventure_name else "Unknown",
+            "image_urls": image_urls if image_urls else [],
+            "technical_input": content,
+            "technical_feedback": technical_analysis,
+            "technical_prompt": TECHNICAL_AGENT_PROMPT,
+            "historical_input": f"User ID: 311",
+            "historical_feedback": knowledge_history,
+            "historical_prompt": KNOWLEDGE_HISTORIK_PROMPT,
+            "meta_input": f"Technical Feedback: {technical_analysis}\nHistorical Feedback: {knowledge_history}",
+            "meta_feedback": final_comment,
+            "meta_prompt": META_AGENT_PROMPT
+        })
 
-async def send_update_to_clients(post_data):
-    if connected_clients:
-        for websocket in connected_clients.copy():
+@router.route("update_prompt", detached=True)
+async def handle_update_prompt(request):
+    global TECHNICAL_AGENT_PROMPT, KNOWLEDGE_HISTORIK_PROMPT, META_AGENT_PROMPT
+    agent = request.data['agent']
+    new_prompt = request.data['prompt']
+    try:
+        if agent == 'technical':
+            TECHNICAL_AGENT_PROMPT = new_prompt
+            await registry.update_instructions(TECHNICAL_AGENT_ID, new_prompt)
+        elif agent == 'historical':
+            KNOWLEDGE_HISTORIK_PROMPT = new_prompt
+            await registry.update_instructions(KNOWLEDGE_HISTORIK_AGENT_ID, new_prompt)
+        elif agent == 'meta':
+            META_AGENT_PROMPT = new_prompt
+            await registry.update_instructions(META_AGENT_ID, new_prompt)
+        print(f"Updated {agent} prompt: {new_prompt}")
+    except Exception as e:
+        print(f"Error updating prompt for {agent}: {e}")
+        request.reply({"error": f"Failed to update prompt for {agent}: {str(e)}"})
+
+@router.route("process_next_post", limit=PROCESS_CONCURRENCY, detached=True)
+async def handle_process_next_post(request):
+    # Claimed from the job queue, so posts waiting out a retry backoff don't block the ones behind them
+    job = await job_queue.claim()
+    if job:
+        post, _, lease = job
+        await process_post(post, BuddyBossClient(), lease=lease)
+    else:
+        await send_update_to_clients({"message": "No unprocessed posts available."})
+
+@router.route("fetch_now")
+async def handle_fetch_now(request):
+    fetch_scheduler.trigger("dashboard")
+    request.reply({"message": "Fetch scheduled."})
+
+@router.route("retry_dead_posts", detached=True)
+async def handle_retry_dead_posts(request):
+    requeued = await run_in_db(retry_dead_jobs)
+    await send_update_to_clients({"message": f"Requeued {requeued} dead-lettered posts.", "job_counts": await job_queue.counts()})
+
+@router.route("process_all_posts", detached=True)
+async def handle_process_all_posts(request):
+    """Run the backlog under this request, so cancelling the request stops the batch."""
+    global batch_task
+    if batch_task and not batch_task.done():
+        request.reply({"error": "A batch is already running."})
+        return
+    try:
+        concurrency = int(request.data.get('concurrency') or PROCESS_CONCURRENCY)
+    except (TypeError, ValueError):
+        concurrency = 0
+    if concurrency < 1:
+        request.reply({"error": "Batch concurrency must be a whole number of at least 1."})
+        return
+    concurrency = min(concurrency, MAX_PROCESS_CONCURRENCY)
+    batch_task = asyncio.create_task(process_backlog(BuddyBossClient(), concurrency))
+    await batch_task
+
+@router.route("reprocess_current_post", detached=True)
+async def handle_reprocess_current_post(request):
+    if current_post_data:
+        post = current_post_data['post']
+        buddyboss_client = BuddyBossClient()
+        await process_post(post, buddyboss_client, reprocess=True, use_cache=not request.data.get('bypass_cache'))
+    else:
+        await send_update_to_clients({"message": "No current post available to reprocess."})
+
+@router.route("preview_prompt_response", limit=WS_PREVIEW_CONCURRENCY)
+async def handle_preview_prompt_response(request):
+    agent = request.data['agent']
+    new_prompt = request.data['prompt']
+    use_cache = not request.data.get('bypass_cache')
+    if not current_post_data:
+        request.reply({"message": "No current post available to preview."})
+        return
+
+    post = current_post_data['post']
+    post_id, user_id, user_name, bp_media_id, adventure_number, content_stripped, activity_id = post
+    log_extra = {"post_id": post_id, "agent": ""}
+
+    try:
+        image_urls = extract_image_urls(post_id, bp_media_id)
+        vector_store_id, vector_store_used = select_vector_store(content_stripped, adventure_number)
+
+        # Candidate prompts are passed as per-run instructions; the production assistants are never modified
+        if agent == 'technical':
+            technical_feedback, detected_adventure_number = await get_technical_feedback(await prepare_images(image_urls), vector_store_id, content_stripped, instructions=new_prompt, use_cache=use_cache)
+            request.reply({"preview_response": {"agent": "technical", "feedback": technical_feedback}})
+        elif agent == 'historical':
+            historical_feedback = await get_historical_feedback(user_id, vector_store_id, instructions=new_prompt, use_cache=use_cache)
+            request.reply({"preview_response": {"agent": "historical", "feedback": historical_feedback}})
+        elif agent == 'meta':
+            # For meta agent preview, we need technical and historical feedback first
+            (technical_feedback, _), historical_feedback = await asyncio.gather(
+                technical_with_images(image_urls, vector_store_id, content_stripped, use_cache=use_cache),
+                get_historical_feedback(user_id, vector_store_id, use_cache=use_cache),
+            )
+            final_comment = await get_final_comment(technical_feedback, historical_feedback, instructions=new_prompt, use_cache=use_cache)
+            request.reply({"preview_response": {"agent": "meta", "feedback": final_comment}})
+    except Exception as e:
+        print(f"Error previewing prompt response for {agent} on Post ID {post_id}: {e}")
+        request.reply({"error": f"Failed to preview prompt response: {str(e)}"})
+
+@router.route("preview_prompt_batch", limit=WS_PREVIEW_CONCURRENCY)
+async def handle_preview_prompt_batch(request):
+    """
+    Compare the live and a candidate prompt for one agent on the most recently processed
+    posts, in parallel. Each post's pair of outputs is sent as soon as it is ready.
+    """
+    agent = request.data['agent']
+    candidate_prompt = request.data['prompt']
+    use_cache = not request.data.get('bypass_cache')
+    post_count = max(1, min(int(request.data.get('post_count') or 5), PREVIEW_BATCH_MAX_POSTS))
+    # The assistants the agents actually run with, read at call time like _warm_up_assistants does
+    assistant_id = {
+        "technical": technical_agent.TECHNICAL_AGENT_ID,
+        "historical": wissens_historik_agent.KNOWLEDGE_HISTORIK_AGENT_ID,
+        "meta": meta_agent.META_AGENT_ID,
+    }.get(agent)
+    if not assistant_id:
+        request.reply({"error": f"No assistant configured for agent {agent}."})
+        return
+    live_prompt = await registry.get_instructions(assistant_id)
+    posts = await run_in_db(get_recent_processed_posts, post_count)
+    if not posts:
+        request.reply({"message": "No processed posts available to compare prompts on."})
+        return
+
+    semaphore = asyncio.Semaphore(PREVIEW_BATCH_CONCURRENCY)
+    progress = {"agent": agent, "total": len(posts), "completed": 0, "failed": 0}
+
+    async def compare(post):
+        post_id, user_name = post[0], post[2]
+        async with semaphore:
             try:
-                await websocket.send_json(post_data)
-            except Exception:
-                connected_clients.remove(websocket)
+                with span("preview.compare", agent=agent):
+                    current, candidate = await compare_prompts(post, agent, live_prompt, candidate_prompt, use_cache)
+                progress["completed"] += 1
+                request.reply({"preview_comparison": {**progress, "post_id": post_id, "user_name": user_name, "current": current, "candidate": candidate}})
+            except Exception as e:
+                progress["failed"] += 1
+                print(f"Error comparing {agent} prompts on Post ID {post_id}: {e}")
+                request.reply({"preview_comparison": {**progress, "post_id": post_id, "user_name": user_name, "error": str(e)}})
+
+    print(f"Comparing {agent} prompts on {len(posts)} recent posts...")
+    await asyncio.gather(*(compare(post) for post in posts))
+    request.reply({"preview_batch_complete": {**progress, "live_prompt": live_prompt}})
+
+@router.route("get_vector_store_files", limit=WS_QUERY_CONCURRENCY)
+async def handle_get_vector_store_files(request):
+    try:
+        await send_vector_store_files(refresh=bool(request.data.get('refresh')))
+    except Exception as e:
+        print(f"Error fetching vector store files: {e}")
+        request.reply({"error": f"Failed to fetch vector store files: {str(e)}"})
+
+@router.route("delete_vector_store_file", limit=WS_QUERY_CONCURRENCY, detached=True)
+async def handle_delete_vector_store_file(request):
+    file_id = request.data['file_id']
+    vector_store_type = request.data['vector_store_type']
+    vector_store_id = ADVANCED_VECTOR_STORE_ID if vector_store_type == 'advanced' else BASIC_VECTOR_STORE_ID
+    try:
+        await get_client().vector_stores.files.delete(vector_store_id=vector_store_id, file_id=file_id)
+        registry.invalidate()
+        await catalog.remove(vector_store_id, file_id)
+        print(f"Deleted file {file_id} from vector store {vector_store_id}")
+        await send_vector_store_files()
+    except Exception as e:
+        print(f"Error deleting vector store file {file_id}: {e}")
+        request.reply({"error": f"Failed to delete vector store file: {str(e)}"})
+
+async def send_update_to_clients(post_data):
+    """Queue a message for every dashboard client. Returns without waiting for delivery."""
+    hub.broadcast(post_data)
+
+async def send_vector_store_files(refresh=False):
+    """Send both vector stores' file lists to the dashboard, from the catalog."""
+    advanced_file_list, basic_file_list = await asyncio.gather(
+        catalog.list_files(ADVANCED_VECTOR_STORE_ID, refresh=refresh),
+        catalog.list_files(BASIC_VECTOR_STORE_ID, refresh=refresh),
+    )
+    await send_update_to_clients({
+        "advanced_vector_store_files": advanced_file_list,
+        "basic_vector_store_files": basic_file_list
+    })
+
+def extract_image_urls(post_id, bp_media_id):
+    """Collect the usable image URLs from a post's bp_media_id attachments."""
+    log_extra = {"post_id": post_id, "agent": ""}
+    image_urls = []
+    if isinstance(bp_media_id, list):
+        for media in bp_media_id:
+            if "attachment_data" in media and isinstance(media["attachment_data"], dict):
+                attachment_data = media["attachment_data"]
+                if "media_theatre_popup" in attachment_data and isinstance(attachment_data["media_theatre_popup"], str) and attachment_data["media_theatre_popup"].startswith("http"):
+                    image_urls.append(attachment_data["media_theatre_popup"])
+                    continue
+            if "url" in media and isinstance(media["url"], str) and media["url"].startswith("http"):
+                image_urls.append(media["url"])
+            else:
+                logging.warning(f"Invalid or missing URL in bp_media_id for Post ID {post_id}: {media}", extra=log_extra)
+    else:
+        if bp_media_id and isinstance(bp_media_id, str) and bp_media_id.startswith("http"):
+            image_urls = [bp_media_id]
+        else:
+            print(f"Skipping image analysis for Post ID {post_id}: No valid image URL.")
+            logging.info(f"Skipping image analysis due to invalid or missing image URL: {bp_media_id}", extra={**log_extra, "agent": "Process"})
+    return image_urls
+
+def select_vector_store(content_stripped, adventure_number):
+    """Pick the Advanced or Basic Cut vector store for a post. Returns (vector_store_id, label)."""
+    content_lower = (content_stripped or "").lower()
+    adventure_lower = str(adventure_number or "").lower()
+    is_advanced = "advanced cut" in content_lower or "advanced" in content_lower or "advanced cut" in adventure_lower or "advanced" in adventure_lower
+    if is_advanced:
+        return ADVANCED_VECTOR_STORE_ID, "Advanced Cut"
+    return BASIC_VECTOR_STORE_ID, "Basic Cut"
+
+def stream_to_clients(post_id, agent):
+    """Return an on_delta callback that pushes partial agent output for a post to the dashboard."""
+    async def on_delta(text):
+        await send_update_to_clients({"partial_feedback": {"post_id": post_id, "agent": agent, "delta": text}})
+    return on_delta
+
+async def timed_stage(timings, stage, awaitable):
+    """Await `awaitable` and record its wall-clock duration in seconds under timings[stage] (and as a span)."""
+    start = time.perf_counter()
+    try:
+        with span(f"stage.{stage}"):
+            return await awaitable
+    finally:
+        timings[stage] = round(time.perf_counter() - start, 3)
+
+async def technical_with_images(image_urls, vector_store_id, content_stripped, timings=None, **kwargs):
+    """Prepare a post's images, then run the Technical Agent on them. Returns (feedback, adventure_number)."""
+    timings = {} if timings is None else timings
+    image_parts = await timed_stage(timings, "images", prepare_images(image_urls))
+    return await timed_stage(timings, "technical", get_technical_feedback(image_parts, vector_store_id, content_stripped, **kwargs))
+
+async def compare_prompts(post, agent, live_prompt, candidate_prompt, use_cache=True):
+    """
+    Run one agent on a post with its live instructions and with `candidate_prompt`, both as
+    per-run overrides and concurrently (once, if the two are the same). Returns (current,
+    candidate). Nothing is stored and the assistants are not modified, so live processing
+    is unaffected.
+    """
+    post_id, user_id, user_name, bp_media_id, adventure_number, content_stripped, activity_id = post
+    image_urls = extract_image_urls(post_id, bp_media_id)
+    vector_store_id, vector_store_used = select_vector_store(content_stripped, adventure_number)
+    instruction_sets = (live_prompt,) if candidate_prompt.strip() == (live_prompt or "").strip() else (live_prompt, candidate_prompt)
+
+    if agent == 'technical':
+        image_parts = await prepare_images(image_urls)
+        results = await asyncio.gather(*(
+            get_technical_feedback(image_parts, vector_store_id, content_stripped, instructions=instructions, use_cache=use_cache)
+            for instructions in instruction_sets
+        ))
+        results = [feedback for feedback, _ in results]
+    elif agent == 'historical':
+        results = await asyncio.gather(*(
+            get_historical_feedback(user_id, vector_store_id, instructions=instructions, use_cache=use_cache)
+            for instructions in instruction_sets
+        ))
+    elif agent == 'meta':
+        # The Meta Agent's inputs come from the live Technical and Historical prompts
+        (technical_feedback, _), historical_feedback = await asyncio.gather(
+            technical_with_images(image_urls, vector_store_id, content_stripped, use_cache=use_cache),
+            get_historical_feedback(user_id, vector_store_id, use_cache=use_cache),
+        )
+        results = await asyncio.gather(*(
+            get_final_comment(technical_feedback, historical_feedback, instructions=instructions, use_cache=use_cache)
+            for instructions in instruction_sets
+        ))
+    else:
+        raise ValueError(f"Unknown agent: {agent}")
+    return results[0], results[-1]
+
+async def process_backlog(buddyboss_client, concurrency=PROCESS_CONCURRENCY):
+    """
+    Drain the ready jobs in the queue with up to `concurrency` posts in flight. A post that
+    fails goes back to the queue with a backoff, so it is not retried within the same batch.
+    """
+    ready = (await job_queue.counts())["ready"]
+    if not ready:
+        await send_update_to_clients({"message": "No unprocessed posts available."})
+        return
+
+    concurrency = max(1, min(concurrency, ready, MAX_PROCESS_CONCURRENCY))
+    progress = {"total": ready, "completed": 0, "failed": 0, "concurrency": concurrency}
+    print(f"Processing backlog of {ready} posts with concurrency {concurrency}...")
+
+    async def worker():
+        while True:
+            job = await job_queue.claim()
+            if job is None:
+                return
+            post, attempt, lease = job
+            post_id = post[0]
+            await send_update_to_clients({"batch_progress": {**progress, "post_id": post_id, "attempt": attempt, "status": "started"}})
+            succeeded = await process_post(post, buddyboss_client, lease=lease)
+            progress["completed" if succeeded else "failed"] += 1
+            await send_update_to_clients({"batch_progress": {**progress, "post_id": post_id, "status": "completed" if succeeded else "failed"}})
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    print(f"Backlog finished: {progress['completed']} completed, {progress['failed']} failed.")
+    logging.info(f"Backlog finished: {progress}", extra={"agent": "Batch"})
+    await send_update_to_clients({"batch_complete": progress, "job_counts": await job_queue.counts()})
+
+async def auto_process_loop():
+    """
+    Process queued posts continuously, with at most AUTO_MAX_IN_FLIGHT in flight and
+    AUTO_POSTS_PER_MINUTE started on average. When the queue is empty the loop sleeps until
+    ingestion signals new jobs, or AUTO_IDLE_POLL_SECONDS pass so expired retry backoffs are
+    picked up.
+    """
+    print(f"Autonomous processing enabled: up to {AUTO_MAX_IN_FLIGHT} posts in flight, {AUTO_POSTS_PER_MINUTE} posts/minute.")
+    slots = asyncio.Semaphore(AUTO_MAX_IN_FLIGHT)
+    running = set()
+    buddyboss_client = BuddyBossClient()
+
+    async def run(post, lease):
+        try:
+            await process_post(post, buddyboss_client, lease=lease)
+        finally:
+            slots.release()
 
-async def process_post(post, buddyboss_client, reprocess=False):
+    try:
+        while True:
+            await slots.acquire()
+            # Rate limit before claiming, so a job's lease doesn't tick away while we wait
+            await post_rate_limiter.acquire()
+            new_jobs.clear()  # Before claiming, so posts stored during the claim still wake us
+            try:
+                job = await job_queue.claim()
+            except Exception as e:
+                slots.release()
+                post_rate_limiter.adjust(1)
+                print(f"Autonomous processing could not claim a job: {e}")
+                logging.error(f"Failed to claim job: {e}", extra={"agent": "Auto"})
+                await asyncio.sleep(AUTO_IDLE_POLL_SECONDS)
+                continue
+            if job is None:
+                slots.release()
+                post_rate_limiter.adjust(1)  # Nothing was started, so give the token back
+                try:
+                    await asyncio.wait_for(new_jobs.wait(), AUTO_IDLE_POLL_SECONDS)
+                except TimeoutError:
+                    pass
+                continue
+            post, _, lease = job
+            task = asyncio.create_task(run(post, lease))
+            running.add(task)
+            task.add_done_callback(running.discard)
+    finally:
+        for task in running:
+            task.cancel()
+
+async def ingestion_backpressure():
+    """
+    Return why ingestion should hold back (large backlog or high failure rate), or None.
+    Only autonomous processing drains the queue on its own, so without it ingestion never waits.
+    """
+    if not AUTO_PROCESS:
+        return None
+    backlog = (await job_queue.counts())["ready"]
+    if backlog > BACKPRESSURE_MAX_BACKLOG:
+        return f"{backlog} posts are waiting to be processed"
+    if len(recent_outcomes) >= BACKPRESSURE_ERROR_WINDOW // 2:
+        error_rate = recent_outcomes.count(False) / len(recent_outcomes)
+        if error_rate > BACKPRESSURE_MAX_ERROR_RATE:
+            return f"{error_rate:.0%} of recent posts failed"
+    return None
+
+async def process_post(post, buddyboss_client, lease=None, reprocess=False, use_cache=True):
+    """
+    Run the agent chain for one post. Returns True on success, False on failure.
+
+    Unless reprocessing, the caller must pass the post's job `lease` (from job_queue.claim); the
+    job is completed on success, or failed and rescheduled with a backoff on error.
+    With use_cache=False every agent runs again instead of answering from the response cache.
+    """
     global current_post_data
     post_id, user_id, user_name, bp_media_id, adventure_number, content_stripped, activity_id = post
     log_extra = {"post_id": post_id, "agent": ""}
+    trace, trace_token = start_trace(post_id)
+    status = "error"
 
     print(f"Starting processing for Post ID {post_id} (Reprocess: {reprocess})...")
     try:
-        image_urls = []
-        if isinstance(bp_media_id, list):
-            for media in bp_media_id:
-                if "attachment_data" in media and isinstance(media["attachment_data"], dict):
-                    attachment_data = media["attachment_data"]
-                    if "media_theatre_popup" in attachment_data and isinstance(attachment_data["media_theatre_popup"], str) and attachment_data["media_theatre_popup"].startswith("http"):
-                        image_urls.append(attachment_data["media_theatre_popup"])
-                        continue
-                if "url" in media and isinstance(media["url"], str) and media["url"].startswith("http"):
-                    image_urls.append(media["url"])
-                else:
-                    logging.warning(f"Invalid or missing URL in bp_media_id for Post ID {post_id}: {media}", extra=log_extra)
-        else:
-            if bp_media_id and isinstance(bp_media_id, str) and bp_media_id.startswith("http"):
-                image_urls = [bp_media_id]
-            else:
-                print(f"Skipping image analysis for Post ID {post_id}: No valid image URL.")
-                logging.info(f"Skipping image analysis due to invalid or missing image URL: {bp_media_id}", extra={**log_extra, "agent": "Process"})
-
-        content_lower = (content_stripped or "").lower()
-        adventure_lower = (adventure_number or "").lower()
-        is_advanced = "advanced cut" in content_lower or "advanced" in content_lower or "advanced cut" in adventure_lower or "advanced" in adventure_lower
-
-        vector_store_id = ADVANCED_VECTOR_STORE_ID if is_advanced else BASIC_VECTOR_STORE_ID
-        vector_store_used = "Advanced Cut" if is_advanced else "Basic Cut"
+        image_urls = extract_image_urls(post_id, bp_media_id)
+        vector_store_id, vector_store_used = select_vector_store(content_stripped, adventure_number)
         print(f"Using vector store: {vector_store_used} (ID: {vector_store_id})")
 
-        print(f"Calling Technical Agent for Post ID {post_id}...")
-        technical_feedback, detected_adventure_number = get_technical_feedback(image_urls[0] if image_urls else None, vector_store_id, content_stripped)
+        # Technical and Historical agents are independent; only the Meta Agent needs both
+        print(f"Calling Technical and Historical Agents for Post ID {post_id}...")
+        stage_timings = {}
+        pipeline_start = time.perf_counter()
+        (technical_feedback, detected_adventure_number), historical_feedback = await asyncio.gather(
+            technical_with_images(image_urls, vector_store_id, content_stripped, stage_timings, on_delta=stream_to_clients(post_id, "technical"), use_cache=use_cache),
+            timed_stage(stage_timings, "historical", get_historical_feedback(user_id, vector_store_id, on_delta=stream_to_clients(post_id, "historical"), use_cache=use_cache)),
+        )
         logging.info(f"Technical Feedback: {technical_feedback}", extra={**log_extra, "agent": "Technical Agent"})
-        print(f"Technical Agent completed for Post ID {post_id}")
-
-        print(f"Calling Historical Agent for Post ID {post_id}...")
-        historical_feedback = get_historical_feedback(user_id, vector_store_id)
         logging.info(f"Historical Feedback: {historical_feedback}", extra={**log_extra, "agent": "Wissens-Historik Agent"})
-        print(f"Historical Agent completed for Post ID {post_id}")
+        print(f"Technical and Historical Agents completed for Post ID {post_id}")
+        if not reprocess:
+            await job_queue.renew(post_id, lease)
 
         print(f"Calling Meta Agent for Post ID {post_id}...")
-        final_comment = get_final_comment(technical_feedback, historical_feedback)
+        final_comment = await timed_stage(stage_timings, "meta", get_final_comment(technical_feedback, historical_feedback, on_delta=stream_to_clients(post_id, "meta"), use_cache=use_cache))
+        stage_timings["total"] = round(time.perf_counter() - pipeline_start, 3)
         logging.info(f"Final Comment: {final_comment}", extra={**log_extra, "agent": "Meta Agent"})
+        logging.info(f"Stage timings (s): {stage_timings}", extra={**log_extra, "agent": "Process"})
         print(f"Meta Agent completed for Post ID {post_id}")
 
         if not reprocess:
+            # History is stored in the same transaction that completes the job, and only while
+            # this lease is still current, so a reclaimed post is never recorded twice
             print(f"Storing results for Post ID {post_id}...")
-            store_user_history(
-                post_id=post_id,
-                user_id=user_id,
-                content=content_stripped,
-                adventure_name=f"Adventure {adventure_number or detected_adventure_number or 'Unknown'}",
-                image_urls=image_urls,
-                technical_analysis=technical_feedback,
-                knowledge_history=historical_feedback,
-                final_comment=final_comment,
-                rating=4,
-                post_date=datetime.now(timezone.utc).isoformat()
-            )
+            with span("db.complete_job"):
+                await job_queue.complete(post_id, lease, history={
+                    "post_id": post_id,
+                    "user_id": user_id,
+                    "content": content_stripped,
+                    "adventure_name": f"Adventure {adventure_number or detected_adventure_number or 'Unknown'}",
+                    "image_urls": image_urls,
+                    "technical_analysis": technical_feedback,
+                    "knowledge_history": historical_feedback,
+                    "final_comment": final_comment,
+                    "rating": 4,
+                    "post_date": datetime.now(timezone.utc).isoformat()
+                })
+            recent_outcomes.append(True)
 
         post_data = {
             "post": post,  # Store the post for reprocessing
@@ -356,7 +797,12 @@ async def process_post(post, buddyboss_client, reprocess=False):
             "historical_prompt": KNOWLEDGE_HISTORIK_PROMPT,
             "meta_input": f"Technical Feedback: {technical_feedback}\nHistorical Feedback: {historical_feedback}",
             "meta_feedback": final_comment,
-            "meta_prompt": META_AGENT_PROMPT
+            "meta_prompt": META_AGENT_PROMPT,
+            "stage_timings": stage_timings,
+            "cache_stats": get_cache_stats(),
+            "job_counts": await job_queue.counts(),
+            "token_usage": trace.usage,
+            "cost_usd": round(trace.cost_usd, 6)
         }
 
         current_post_data = post_data  # Store the current post data for reprocessing
@@ -370,101 +816,90 @@ async def process_post(post, buddyboss_client, reprocess=False):
         print(f"Technical Feedback: {technical_feedback}")
         print(f"Historical Feedback: {historical_feedback}")
         print(f"Final Comment: {final_comment}")
+        print(f"Stage Timings (s): {stage_timings}")
         print("=====================================\n")
 
         await send_update_to_clients(post_data)
-        if not reprocess:
-            mark_post_processed(post_id)
+        status = "success"
+        return True
+    except job_queue.LeaseLost as e:
+        # Another worker reclaimed the post and owns its outcome now; nothing to record here
+        print(f"Abandoning Post ID {post_id}: {e}")
+        logging.warning(f"Abandoned post: {e}", extra={**log_extra, "agent": "Process"})
+        return False
     except Exception as e:
         print(f"Error processing Post ID {post_id}: {e}")
         logging.error(f"Error processing post: {e}", extra={**log_extra, "agent": "Process"})
+        if not reprocess:
+            await job_queue.fail(post_id, lease, e)
+            recent_outcomes.append(False)
         await send_update_to_clients({"error": f"Failed to process post: {str(e)}"})
-
-async def main(debug_mode=False):
-    create_tables()
-    # Verify connection without passing a token (handled internally by verify_connection)
-    connection_retries = 0
-    max_retries = 5
-    while connection_retries < max_retries:
-        if verify_connection():
-            print("Successfully connected to BuddyBoss API.")
-            break
-        else:
-            connection_retries += 1
-            print(f"Connection to BuddyBoss API failed. Retry {connection_retries}/{max_retries}. Retrying in 60 seconds...")
-            await asyncio.sleep(60)
-
-    if connection_retries >= max_retries:
-        print(f"Failed to connect to BuddyBoss API after {max_retries} retries. Continuing without fetching posts.")
-        logging.error(f"Failed to connect to BuddyBoss API after {max_retries} retries.")
-        buddyboss_client = None
-    else:
-        buddyboss_client = BuddyBossClient()
-
-    if buddyboss_client:
-        print("Fetching all posts on first run...")
+        return False
+    finally:
+        trace_data = finish_trace(trace, trace_token, status)
         try:
-            posts = fetch_posts_from_website()
-            logging.info(f"Fetched {len(posts)} posts: {posts}")
-            print(f"Fetched {len(posts)} posts.")
-            for post in posts:
-                insert_post(
-                    user_id=post["user_id"],
-                    name=post.get("name", f"User_{post['user_id']}"),
-                    bp_media_id=post["bp_media_id"],
-                    adventure_number=post["adventure_number"],
-                    adventure_level=post["adventure_level"],
-                    content_stripped=post["content_stripped"],
-                    post_timestamp=post["timestamp"],
-                    activity_id=post["activity_id"]
-                )
+            await run_in_db(store_post_trace, trace_data)
         except Exception as e:
-            logging.error(f"Failed to fetch posts: {e}")
-            print(f"Failed to fetch posts: {e}")
-
-    fetch_interval = int(os.getenv("FETCH_INTERVAL_SECONDS", "3600"))  # Default to 1 hour if not set
-    last_fetch = datetime.now()
+            print(f"Failed to store trace for Post ID {post_id}: {e}")
+
+async def ingest_new_posts():
+    """
+    Fetch every activity after the stored cursor, page by page, storing each page and
+    checkpointing the cursor in one transaction. Returns the number of new posts stored.
+    """
+    cursor = await run_in_db(get_fetch_cursor)
+    print(f"Fetching new posts since {cursor[1] if cursor else 'the beginning'}...")
+    fetched = inserted = 0
+    async for page in iter_post_pages(cursor):
+        fetched += len(page)
+        with span("db.insert_posts"):
+            inserted += await run_in_db(insert_posts, page, advance_cursor=True)
+        logging.info(f"Fetched page of {len(page)} posts: {page}")
+        print(f"Fetched {len(page)} posts; cursor now at activity {page[-1]['activity_id']} ({page[-1]['timestamp']}).")
+    print(f"Fetched {fetched} new posts, stored {inserted}.")
+    if inserted:
+        new_jobs.set()
+    return inserted
+
+async def fetch_cycle():
+    """Ingest new posts unless backpressure says to wait. Returns the number stored, or None if held back."""
+    reason = await ingestion_backpressure()
+    if reason:
+        print(f"Holding back ingestion: {reason}.")
+        logging.info(f"Ingestion held back: {reason}", extra={"agent": "Fetch"})
+        return None
+    return await ingest_new_posts()
 
+async def main(debug_mode=False):
+    await run_in_db(create_tables)
+    purged = await run_in_db(purge_expired_responses, CACHE_TTL_SECONDS)
+    if purged:
+        print(f"Purged {purged} expired agent cache entries.")
+
+    # Fetch straight away on startup; after that fetch_scheduler decides when the next one runs
+    connected = False
+    fetch_scheduler.trigger("startup")
     while True:
+        reason = await fetch_scheduler.wait()
         try:
-            if (datetime.now() - last_fetch).total_seconds() >= fetch_interval:
-                if not buddyboss_client:
-                    print("No BuddyBoss client available. Attempting to reconnect...")
-                    if verify_connection():
-                        buddyboss_client = BuddyBossClient()
-                        print("Reconnected to BuddyBoss API.")
-                    else:
-                        print("Failed to reconnect to BuddyBoss API. Skipping fetch cycle.")
-                        logging.error("Failed to reconnect to BuddyBoss API during fetch cycle.")
-                        await asyncio.sleep(3600)
-                        continue
-
-                last_timestamp = get_latest_post_timestamp()
-                print(f"Fetching new posts since {last_timestamp}...")
-                try:
-                    new_posts = fetch_posts_from_website(last_timestamp)
-                    logging.info(f"Fetched {len(new_posts)} new posts: {new_posts}")
-                    print(f"Fetched {len(new_posts)} new posts.")
-                    for post in new_posts:
-                        insert_post(
-                            user_id=post["user_id"],
-                            name=post.get("name", f"User_{post['user_id']}"),
-                            bp_media_id=post["bp_media_id"],
-                            adventure_number=post["adventure_number"],
-                            adventure_level=post["adventure_level"],
-                            content_stripped=post["content_stripped"],
-                            post_timestamp=post["timestamp"],
-                            activity_id=post["activity_id"]
-                        )
-                    last_fetch = datetime.now()
-                except Exception as e:
-                    logging.error(f"Failed to fetch new posts: {e}")
-                    print(f"Failed to fetch new posts: {e}")
-            await asyncio.sleep(3600)
+            if not connected:
+                # Verify connection without passing a token (handled internally by verify_connection)
+                if not await verify_connection():
+                    delay = fetch_scheduler.record_failure()
+                    print(f"Connection to BuddyBoss API failed. Retrying in about {delay:.0f} seconds...")
+                    logging.error(f"Connection to BuddyBoss API failed ({fetch_scheduler.consecutive_errors} consecutive failures).")
+                    continue
+                connected = True
+                print("Successfully connected to BuddyBoss API.")
+
+            print(f"Fetching new posts (trigger: {reason})...")
+            inserted = await fetch_cycle()
+            fetch_scheduler.record_success(inserted)
+            print(f"Next fetch in about {fetch_scheduler.status()['interval_seconds']} seconds.")
         except Exception as e:
-            logging.error(f"Error in main loop: {e}")
-            print(f"Error in main loop: {e}")
-            await asyncio.sleep(60)  # Wait before retrying
+            delay = fetch_scheduler.record_failure()
+            logging.error(f"Failed to fetch new posts: {e}")
+            print(f"Failed to fetch new posts: {e}. Retrying in about {delay:.0f} seconds...")
 
 # Entry point to run both the main coroutine and the FastAPI app
 if __name__ == "__main__":
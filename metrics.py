@@ -0,0 +1,161 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+METRIC_PREFIX = "hairdresser"
+# Seconds; spans range from sub-millisecond DB writes to minute-long assistant runs
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+# USD per million tokens, used to estimate what each post costs (defaults: gpt-4o list prices)
+PROMPT_PRICE_PER_MTOK = float(os.getenv("OPENAI_PROMPT_PRICE_PER_MTOK", "2.5"))
+COMPLETION_PRICE_PER_MTOK = float(os.getenv("OPENAI_COMPLETION_PRICE_PER_MTOK", "10"))
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = f"{METRIC_PREFIX}_{name}"
+        self.help_text = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in sorted(self.values.items())]
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = f"{METRIC_PREFIX}_{name}"
+        self.help_text = help_text
+        self.buckets = buckets
+        self.values = {}  # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        series = self.values.setdefault(key, [0] * len(self.buckets) + [0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {round(series[-2], 6)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+SPAN_SECONDS = Histogram("span_seconds", "Duration of instrumented stages, by span name and agent.")
+POST_SECONDS = Histogram("post_seconds", "End-to-end processing time per post.")
+POSTS = Counter("posts_total", "Posts processed, by outcome.")
+OPENAI_TOKENS = Counter("openai_tokens_total", "OpenAI tokens used by assistant runs, by agent and kind.")
+OPENAI_COST = Counter("openai_cost_usd_total", "Estimated OpenAI spend in USD, by agent.")
+AGENT_CACHE_LOOKUPS = Counter("agent_cache_lookups_total", "Agent response cache lookups, by result.")
+WEBSOCKET_MESSAGES = Counter("websocket_messages_total", "Dashboard messages per client, by outcome (sent, coalesced, dropped).")
+METRICS = [SPAN_SECONDS, POST_SECONDS, POSTS, OPENAI_TOKENS, OPENAI_COST, AGENT_CACHE_LOOKUPS, WEBSOCKET_MESSAGES]
+
+# The trace of the post being processed in the current task (None outside process_post)
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+class Trace:
+    """Spans and token usage collected while processing one post."""
+
+    def __init__(self, post_id):
+        self.post_id = post_id
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.spans = []
+        self.usage = {}
+        self.cost_usd = 0.0
+
+    def offset(self):
+        return time.perf_counter() - self._start
+
+    def to_dict(self, status):
+        return {
+            "post_id": self.post_id,
+            "started_at": self.started_at,
+            "duration": round(self.offset(), 4),
+            "status": status,
+            "spans": self.spans,
+            "usage": self.usage,
+            "cost_usd": round(self.cost_usd, 6),
+        }
+
+def start_trace(post_id):
+    """Start collecting spans for `post_id` in the current task. Returns (trace, reset_token)."""
+    trace = Trace(post_id)
+    return trace, current_trace.set(trace)
+
+def finish_trace(trace, reset_token, status):
+    """Stop collecting for `trace`, record the post-level metrics and return it as a dict."""
+    current_trace.reset(reset_token)
+    POSTS.inc(status=status)
+    POST_SECONDS.observe(trace.offset(), status=status)
+    return trace.to_dict(status)
+
+@contextmanager
+def span(name, traced=True, **labels):
+    """
+    Time the enclosed block into SPAN_SECONDS and, inside process_post, the post's trace.
+    traced=False keeps high-frequency spans (e.g. streamed deltas) out of the trace.
+    """
+    trace = current_trace.get() if traced else None
+    started_at = trace.offset() if trace else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        SPAN_SECONDS.observe(duration, span=name, **labels)
+        if trace:
+            trace.spans.append({"name": name, **labels, "start": round(started_at, 4), "duration": round(duration, 4)})
+
+def record_usage(agent, usage):
+    """Count a run's token usage and estimated cost, globally and on the current post's trace."""
+    prompt_tokens, completion_tokens = usage.prompt_tokens or 0, usage.completion_tokens or 0
+    cost = (prompt_tokens * PROMPT_PRICE_PER_MTOK + completion_tokens * COMPLETION_PRICE_PER_MTOK) / 1_000_000
+    OPENAI_TOKENS.inc(prompt_tokens, agent=agent, kind="prompt")
+    OPENAI_TOKENS.inc(completion_tokens, agent=agent, kind="completion")
+    OPENAI_COST.inc(cost, agent=agent)
+    trace = current_trace.get()
+    if trace:
+        totals = trace.usage.setdefault(agent, {"prompt_tokens": 0, "completion_tokens": 0})
+        totals["prompt_tokens"] += prompt_tokens
+        totals["completion_tokens"] += completion_tokens
+        trace.cost_usd += cost
+
+def render(gauges=None, counters=None):
+    """
+    Every metric in the Prometheus text exposition format. `gauges` maps extra gauge names
+    to {label_tuple: value} dicts or plain values, for state read at scrape time; `counters`
+    does the same for monotonic totals kept elsewhere (names without the _total suffix).
+    """
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    for kind, suffix, values in (("gauge", "", gauges), ("counter", "_total", counters)):
+        for name, value in (values or {}).items():
+            full_name = f"{METRIC_PREFIX}_{name}{suffix}"
+            lines.append(f"# TYPE {full_name} {kind}")
+            if isinstance(value, dict):
+                lines += [f"{full_name}{_format_labels(key)} {v}" for key, v in value.items()]
+            else:
+                lines.append(f"{full_name} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,44 @@
+import asyncio
+import time
+
+class TokenBucket:
+    """
+    Async token bucket: tokens refill continuously at `rate` per second up to `capacity`,
+    and acquire() waits until enough are available. Waiters are served in arrival order,
+    so a large request can't be starved by a stream of small ones.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, tokens=1):
+        """Wait until `tokens` are available and take them. Requests above capacity are capped to it."""
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+
+    def adjust(self, tokens):
+        """
+        Add (or, when negative, take) tokens without waiting, e.g. to settle an estimate once
+        the real cost is known. The balance may go negative, which delays later acquirers.
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + tokens)
+
+    def available(self):
+        """Tokens that could be taken right now."""
+        self._refill()
+        return self.tokens
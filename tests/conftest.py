@@ -0,0 +1,22 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Point the shared connection at a fresh database file for one test."""
+    database.close_connection()
+    path = str(tmp_path / "test.db")
+    monkeypatch.setattr(database, "DATABASE", path)
+    yield path
+    database.close_connection()
+
+@pytest.fixture
+def db(db_path):
+    """A fresh database with every migration applied."""
+    database.create_tables()
+    return database
@@ -0,0 +1,51 @@
+import asyncio
+import httpx
+import fetch_posts
+
+def activity(activity_id, date):
+    return {"id": activity_id, "user_id": 1, "date": date, "content_stripped": f"Abenteuer {activity_id} Basic Cut"}
+
+def fake_feed(monkeypatch, pages):
+    """Serve `pages` (lists of activities) in order and record the params of each request."""
+    requests = []
+
+    async def authorized_request(method, url, params=None, **kwargs):
+        requests.append(params)
+        return httpx.Response(200, json=pages[params["page"] - 1], headers={"X-WP-TotalPages": str(len(pages))})
+
+    monkeypatch.setattr(fetch_posts, "authorized_request", authorized_request)
+    return requests
+
+def collect(cursor=None, per_page=2):
+    async def run():
+        return [page async for page in fetch_posts.iter_post_pages(cursor, per_page=per_page)]
+    return asyncio.run(run())
+
+def test_walks_every_page_oldest_first(monkeypatch):
+    requests = fake_feed(monkeypatch, [
+        [activity(2, "2024-01-01T10:00:02"), activity(1, "2024-01-01T10:00:01")],
+        [activity(3, "2024-01-01T10:00:03")],
+    ])
+    pages = collect()
+    assert [[post["activity_id"] for post in page] for page in pages] == [[1, 2], [3]]
+    assert [params["page"] for params in requests] == [1, 2]
+    assert all(params["order"] == "asc" and "after" not in params for params in requests)
+
+def test_skips_posts_at_or_before_the_cursor(monkeypatch):
+    requests = fake_feed(monkeypatch, [[
+        activity(4, "2024-01-01T10:00:00"),
+        activity(5, "2024-01-01T10:00:00"),  # Same second as the cursor but a newer activity
+        activity(6, "2024-01-01T10:00:05"),
+    ]])
+    pages = collect(cursor=(4, "2024-01-01T10:00:00"), per_page=10)
+    assert [post["activity_id"] for post in pages[0]] == [5, 6]
+    assert requests[0]["after"] == "2024-01-01T09:59:59"  # One second of overlap
+
+def test_insert_posts_checkpoints_the_cursor_per_page(db):
+    page = [fetch_posts.format_post(activity(1, "2024-01-01T10:00:01")), fetch_posts.format_post(activity(2, "2024-01-01T10:00:02"))]
+    assert db.insert_posts(page, advance_cursor=True) == 2
+    assert db.get_fetch_cursor() == (2, "2024-01-01T10:00:02")
+    # Re-delivered posts are deduplicated and never move the cursor backwards
+    assert db.insert_posts(page[:1], advance_cursor=True) == 0
+    assert db.get_fetch_cursor() == (2, "2024-01-01T10:00:02")
+    assert db.get_job_counts()["queued"] == 2
@@ -0,0 +1,56 @@
+import asyncio
+from fetch_scheduler import FetchScheduler
+
+def scheduler(min_interval=0.2):
+    return FetchScheduler(interval=60, min_interval=min_interval, error_backoff=60, max_backoff=60, jitter_ratio=0)
+
+def test_webhook_right_after_a_fetch_is_held_not_dropped():
+    async def run():
+        fetches = scheduler()
+        fetches.trigger("startup")
+        assert await fetches.wait() == "startup"
+        # Three webhooks inside min_interval collapse into one fetch once it has passed
+        assert fetches.trigger("webhook", external=True)
+        assert fetches.trigger("webhook", external=True)
+        assert fetches.trigger("webhook", external=True)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        assert await asyncio.wait_for(fetches.wait(), 5) == "webhook"
+        held = loop.time() - start
+        assert not fetches._triggered.is_set()
+        return held
+
+    assert 0.1 < asyncio.run(run()) < 1
+
+def test_webhook_after_min_interval_fetches_immediately():
+    async def run():
+        fetches = scheduler(min_interval=0.01)
+        fetches.trigger("startup")
+        await fetches.wait()
+        await asyncio.sleep(0.02)
+        assert fetches.trigger("webhook", external=True)
+        return await asyncio.wait_for(fetches.wait(), 0.1)
+
+    assert asyncio.run(run()) == "webhook"
+
+def test_webhook_during_error_backoff_is_refused():
+    async def run():
+        fetches = scheduler()
+        fetches.trigger("startup")
+        await fetches.wait()
+        fetches.record_failure()
+        return fetches.trigger("webhook", external=True), fetches._deferred
+
+    assert asyncio.run(run()) == (False, None)
+
+def test_held_trigger_is_dropped_when_the_fetch_before_it_failed():
+    async def run():
+        fetches = scheduler(min_interval=0.05)
+        fetches.trigger("startup")
+        await fetches.wait()
+        fetches.trigger("webhook", external=True)
+        fetches.record_failure()
+        await asyncio.sleep(0.1)
+        return fetches._triggered.is_set()
+
+    assert asyncio.run(run()) is False
@@ -0,0 +1,109 @@
+import asyncio
+import time
+import pytest
+import job_queue
+
+def add_post(db, post_id, processed=0):
+    with db.transaction() as cursor:
+        cursor.execute(
+            "INSERT INTO user_posts (id, user_id, name, bp_media_id, adventure_number, content_stripped, activity_id, processed) VALUES (?, 1, 'User', NULL, '1', 'Basic Cut', ?, ?)",
+            (post_id, post_id, processed)
+        )
+        db._enqueue_unprocessed_posts(cursor)
+
+def history(post_id):
+    return {
+        "post_id": post_id, "user_id": 1, "content": "Basic Cut", "adventure_name": "Adventure 1", "image_urls": [],
+        "technical_analysis": "technical", "knowledge_history": "historical", "final_comment": "final", "rating": 4, "post_date": "2024-01-01",
+    }
+
+def job(db, post_id):
+    with db.transaction() as cursor:
+        cursor.execute("SELECT state, attempts, lease_owner, available_at FROM post_jobs WHERE post_id = ?", (post_id,))
+        return cursor.fetchone()
+
+def test_claim_returns_post_and_leases_it(db):
+    add_post(db, 1)
+    post, attempt, lease = db.claim_job("worker-a", 60)
+    assert post[0] == 1 and attempt == 1
+    assert lease.startswith("worker-a:")
+    assert job(db, 1)[:3] == ("leased", 1, lease)
+    assert db.claim_job("worker-b", 60) is None
+
+def test_complete_stores_history_and_marks_processed(db):
+    add_post(db, 1)
+    _, _, lease = db.claim_job("worker-a", 60)
+    assert db.complete_job(1, lease, history(1)) is True
+    assert job(db, 1)[0] == "done"
+    assert len(db.fetch_user_history(1)) == 1
+    assert db.fetch_user_history_summary(1)["notes"][0]["post_id"] == 1
+    assert db.get_recent_processed_posts(5)[0][0] == 1
+
+def test_expired_lease_is_reclaimed_and_old_holder_cannot_complete(db):
+    add_post(db, 1)
+    _, _, stale = db.claim_job("worker-a", -1)  # Lease already expired
+    post, attempt, lease = db.claim_job("worker-b", 60)
+    assert post[0] == 1 and attempt == 2
+    assert db.renew_job_lease(1, stale, 60) is False
+    assert db.complete_job(1, stale, history(1)) is False
+    assert db.fail_job(1, stale, "late", 5, 60, 3600) is None
+    assert db.fetch_user_history(1) == []
+    assert db.complete_job(1, lease, history(1)) is True
+    assert len(db.fetch_user_history(1)) == 1
+
+def test_stale_claim_in_the_same_process_cannot_touch_a_reclaimed_job(db, monkeypatch):
+    # Every coroutine in a process shares job_queue.WORKER_ID; the per-claim lease tells them apart
+    add_post(db, 1)
+
+    async def run():
+        monkeypatch.setattr(job_queue, "LEASE_SECONDS", -1)
+        _, _, stale = await job_queue.claim()
+        monkeypatch.setattr(job_queue, "LEASE_SECONDS", 60)
+        post, attempt, lease = await job_queue.claim()
+        assert post[0] == 1 and attempt == 2 and lease != stale
+        with pytest.raises(job_queue.LeaseLost):
+            await job_queue.renew(1, stale)
+        assert await job_queue.fail(1, stale, "late") is None
+        with pytest.raises(job_queue.LeaseLost):
+            await job_queue.complete(1, stale, history(1))
+        await job_queue.complete(1, lease, history(1))
+
+    asyncio.run(run())
+    assert job(db, 1)[0] == "done"
+    assert len(db.fetch_user_history(1)) == 1
+
+def test_renewed_lease_is_not_reclaimed(db):
+    add_post(db, 1)
+    _, _, lease = db.claim_job("worker-a", -1)
+    assert db.renew_job_lease(1, lease, 60) is True
+    assert db.claim_job("worker-b", 60) is None
+
+def test_failed_job_backs_off_then_dead_letters(db):
+    add_post(db, 1)
+    _, _, lease = db.claim_job("worker-a", 60)
+    before = time.time()
+    assert db.fail_job(1, lease, "boom", 2, 60, 3600) == "failed"
+    state, attempts, owner, available_at = job(db, 1)
+    assert (state, attempts, owner) == ("failed", 1, None)
+    assert available_at >= before + 60
+    assert db.claim_job("worker-a", 60) is None  # Still backing off
+
+    with db.transaction() as cursor:
+        cursor.execute("UPDATE post_jobs SET available_at = 0 WHERE post_id = 1")
+    _, attempt, lease = db.claim_job("worker-a", 60)
+    assert attempt == 2
+    assert db.fail_job(1, lease, "boom", 2, 60, 3600) == "dead"
+    assert db.get_job_counts()["dead"] == 1
+    assert db.claim_job("worker-a", 60) is None
+
+    assert db.retry_dead_jobs() == 1
+    assert db.claim_job("worker-a", 60)[1] == 1
+
+def test_job_counts_report_ready_jobs(db):
+    add_post(db, 1)
+    add_post(db, 2)
+    add_post(db, 3, processed=1)
+    db.claim_job("worker-a", 60)
+    counts = db.get_job_counts()
+    assert counts["queued"] == 1 and counts["leased"] == 1 and counts["ready"] == 1
+    assert counts["done"] == 0  # Posts stored already processed are never enqueued
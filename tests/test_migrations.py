@@ -0,0 +1,75 @@
+import sqlite3
+import pytest
+import database
+
+BASELINE_SCHEMA = [
+    '''CREATE TABLE user_posts (id INTEGER PRIMARY KEY, user_id INTEGER, name TEXT, bp_media_id TEXT, adventure_number TEXT,
+       adventure_level TEXT, content_stripped TEXT, post_timestamp TEXT, activity_id INTEGER, processed INTEGER DEFAULT 0)''',
+    '''CREATE TABLE user_history (id INTEGER PRIMARY KEY AUTOINCREMENT, post_id INTEGER, user_id INTEGER, content TEXT, adventure_name TEXT,
+       image_urls TEXT, technical_analysis TEXT, knowledge_history TEXT, final_comment TEXT, rating INTEGER, post_date TEXT)''',
+    "CREATE TABLE fetch_timestamps (id INTEGER PRIMARY KEY AUTOINCREMENT, last_fetch TEXT)",
+]
+
+def make_baseline_db(path):
+    """A database as the pre-migration code left it, including duplicate activities."""
+    conn = sqlite3.connect(path)
+    for statement in BASELINE_SCHEMA:
+        conn.execute(statement)
+    posts = [
+        (1, 10, 100, "2024-01-01T10:00:00", 1),
+        (2, 10, 100, "2024-01-01T10:00:00", 0),  # Duplicate of post 1
+        (3, 11, 101, "2024-01-02T10:00:00", 0),
+        (4, 11, 101, "2024-01-02T10:00:00", 0),  # Duplicate of post 3
+        (5, 12, 102, "2024-01-03T10:00:00", 0),
+    ]
+    conn.executemany("INSERT INTO user_posts (id, user_id, activity_id, post_timestamp, processed) VALUES (?, ?, ?, ?, ?)", posts)
+    conn.executemany(
+        "INSERT INTO user_history (post_id, user_id, adventure_name, final_comment, rating, post_date) VALUES (?, ?, ?, ?, ?, ?)",
+        [(1, 10, "Adventure 1", "Good start", 4, "2024-01-01"), (6, 10, "Adventure 2", "Better", 5, "2024-01-05")]
+    )
+    conn.commit()
+    conn.close()
+
+def test_baseline_database_upgrades_in_place(db_path):
+    make_baseline_db(db_path)
+    database.create_tables()
+
+    with database.transaction() as cursor:
+        cursor.execute("PRAGMA user_version")
+        assert cursor.fetchone()[0] == len(database.MIGRATIONS)
+        cursor.execute("SELECT id FROM user_posts ORDER BY id")
+        assert [row[0] for row in cursor.fetchall()] == [1, 3, 5]
+        cursor.execute("SELECT post_id, state FROM post_jobs ORDER BY post_id")
+        assert cursor.fetchall() == [(1, "done"), (3, "queued"), (5, "queued")]
+
+    summary = database.fetch_user_history_summary(10)
+    assert summary["entries"] == 2 and summary["rating_total"] == 9
+    assert [note["post_id"] for note in summary["notes"]] == [1, 6]
+
+def test_duplicate_activities_are_rejected_after_upgrade(db_path):
+    make_baseline_db(db_path)
+    database.create_tables()
+    with pytest.raises(sqlite3.IntegrityError):
+        with database.transaction() as cursor:
+            cursor.execute("INSERT INTO user_posts (user_id, activity_id) VALUES (10, 100)")
+
+def test_migrate_is_idempotent(db):
+    version = db.migrate()
+    assert version == len(db.MIGRATIONS)
+    assert db.migrate() == version
+
+def test_failed_migration_keeps_earlier_ones(db_path, monkeypatch):
+    def broken(cursor):
+        """Fail halfway through."""
+        cursor.execute("CREATE TABLE half_done (id INTEGER)")
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(database, "MIGRATIONS", database.MIGRATIONS[:2] + [broken])
+    with pytest.raises(RuntimeError):
+        database.create_tables()
+
+    with database.transaction() as cursor:
+        cursor.execute("PRAGMA user_version")
+        assert cursor.fetchone()[0] == 2
+        cursor.execute("SELECT name FROM sqlite_master WHERE name = 'half_done'")
+        assert cursor.fetchone() is None
@@ -0,0 +1,95 @@
+import asyncio
+import time
+import httpx
+import pytest
+from rate_limit import TokenBucket
+from agents import governor as governor_module
+from agents.governor import RateGovernor, GovernedTransport, parse_duration
+
+def test_bucket_starts_full_and_waits_for_refill():
+    async def run():
+        bucket = TokenBucket(rate=20, capacity=2)
+        start = time.monotonic()
+        await bucket.acquire()
+        await bucket.acquire()
+        assert time.monotonic() - start < 0.02
+        await bucket.acquire()  # Empty: waits about 1/20 s for the next token
+        return time.monotonic() - start
+
+    assert 0.04 <= asyncio.run(run()) < 0.5
+
+def test_bucket_caps_requests_at_capacity():
+    async def run():
+        bucket = TokenBucket(rate=1000, capacity=5)
+        await asyncio.wait_for(bucket.acquire(50), 1)
+        return bucket.available()
+
+    assert asyncio.run(run()) < 1
+
+def test_bucket_adjust_can_go_negative_and_never_exceeds_capacity():
+    bucket = TokenBucket(rate=1, capacity=10)
+    bucket.adjust(100)
+    assert bucket.available() == pytest.approx(10, abs=0.01)
+    bucket.adjust(-15)
+    assert bucket.available() < 0
+
+def test_bucket_serves_waiters_in_arrival_order():
+    async def run():
+        bucket = TokenBucket(rate=50, capacity=1)
+        await bucket.acquire()
+        order = []
+
+        async def take(name, tokens):
+            await bucket.acquire(tokens)
+            order.append(name)
+
+        await asyncio.gather(take("large", 1), take("small", 0.1))
+        return order
+
+    assert asyncio.run(run()) == ["large", "small"]
+
+def test_parse_duration():
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("1.5s") == 1.5
+    assert parse_duration("") is None
+
+def test_governed_transport_retries_429_and_pauses_everyone(monkeypatch):
+    monkeypatch.setattr(governor_module, "OPENAI_MAX_RETRIES", 3)
+    responses = [
+        httpx.Response(429, headers={"retry-after-ms": "10"}),
+        httpx.Response(503),
+        httpx.Response(200, json={"ok": True}, headers={"x-ratelimit-remaining-requests": "7"}),
+    ]
+    seen_bodies = []
+
+    def handler(request):
+        seen_bodies.append(request.content)
+        return responses.pop(0)
+
+    async def run():
+        governor = RateGovernor(rpm=600, tpm=60000)
+        monkeypatch.setattr(governor, "retry_delay", lambda attempt, response=None: 0.01)
+        client = httpx.AsyncClient(transport=GovernedTransport(governor, httpx.MockTransport(handler)))
+        response = await client.post("https://api.openai.com/v1/threads", json={"a": 1})
+        await client.aclose()
+        return governor, response
+
+    governor, response = asyncio.run(run())
+    assert response.status_code == 200
+    assert governor.stats == {"requests": 3, "retries": 2, "rate_limited": 1}
+    assert len(set(seen_bodies)) == 1  # The body was replayed unchanged on every attempt
+    assert governor.requests.available() == pytest.approx(7, abs=0.5)  # Synced to the server's count
+
+def test_governed_transport_returns_last_error_response(monkeypatch):
+    monkeypatch.setattr(governor_module, "OPENAI_MAX_RETRIES", 1)
+
+    async def run():
+        governor = RateGovernor(rpm=600, tpm=60000)
+        monkeypatch.setattr(governor, "retry_delay", lambda attempt, response=None: 0)
+        client = httpx.AsyncClient(transport=GovernedTransport(governor, httpx.MockTransport(lambda request: httpx.Response(500))))
+        response = await client.get("https://api.openai.com/v1/models")
+        await client.aclose()
+        return response
+
+    assert asyncio.run(run()).status_code == 500
@@ -0,0 +1,104 @@
+import asyncio
+import itertools
+import logging
+from broadcast import hub
+
+_request_ids = itertools.count(1)
+
+class WebSocketRequest:
+    """One incoming dashboard message, as seen by its handler."""
+
+    def __init__(self, websocket, request_id, message_type, data):
+        self.websocket = websocket
+        self.id = request_id
+        self.type = message_type
+        self.data = data
+
+    def reply(self, message):
+        """Send `message` to the requesting client only, tagged with the request id."""
+        hub.send(self.websocket, {**message, "request_id": self.id})
+
+class MessageRouter:
+    """
+    Dispatch table for /ws messages. Each message runs as its own task, so one connection can
+    have several operations in flight and gets their results as they finish. Concurrency is
+    limited per message type, across all connections, and a request can be cancelled by id.
+    """
+
+    def __init__(self):
+        self.handlers = {}  # message type -> (handler, semaphore, detached)
+        self.running = set()
+
+    def route(self, message_type, limit=1, detached=False):
+        """
+        Register `handler(request)` for `message_type`, with at most `limit` running at once.
+        Detached handlers change shared state (e.g. process a post) and keep running when the
+        connection that started them closes; the others are cancelled with it.
+        """
+        def register(handler):
+            self.handlers[message_type] = (handler, asyncio.Semaphore(limit), detached)
+            return handler
+        return register
+
+    def connection(self, websocket):
+        return RouterConnection(self, websocket)
+
+class RouterConnection:
+    """The requests one WebSocket connection has in flight."""
+
+    def __init__(self, router, websocket):
+        self.router = router
+        self.websocket = websocket
+        self.tasks = {}  # request id -> (message type, task, detached)
+
+    def dispatch(self, data):
+        """Start handling a decoded message. Returns immediately."""
+        message_type = data.get("type")
+        request_id = str(data.get("request_id") or f"server-{next(_request_ids)}")
+        request = WebSocketRequest(self.websocket, request_id, message_type, data)
+        if message_type == "cancel":
+            self.cancel(str(data.get("target_id")), request)
+            return
+        if message_type not in self.router.handlers:
+            request.reply({"error": f"Unknown message type: {message_type}"})
+            return
+        if request_id in self.tasks:
+            request.reply({"error": f"Request {request_id} is already running."})
+            return
+
+        handler, semaphore, detached = self.router.handlers[message_type]
+        task = asyncio.create_task(self._run(handler, semaphore, request))
+        self.tasks[request_id] = (message_type, task, detached)
+        self.router.running.add(task)
+        task.add_done_callback(self.router.running.discard)
+        task.add_done_callback(lambda _: self.tasks.pop(request_id, None))
+
+    async def _run(self, handler, semaphore, request):
+        status = "failed"
+        try:
+            async with semaphore:
+                await handler(request)
+            status = "done"
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        except Exception as e:
+            print(f"Error handling WebSocket message {request.type} ({request.id}): {e}")
+            logging.error(f"Error handling WebSocket message {request.type}: {e}")
+            request.reply({"error": f"WebSocket message error: {str(e)}"})
+        finally:
+            request.reply({"request_finished": {"request_id": request.id, "type": request.type, "status": status}})
+
+    def cancel(self, request_id, request):
+        entry = self.tasks.get(request_id)
+        if entry is None:
+            request.reply({"error": f"No running request {request_id} to cancel."})
+            return
+        entry[1].cancel()
+        print(f"Cancelled WebSocket request {request_id} ({entry[0]}).")
+
+    def close(self):
+        """Cancel this connection's requests, except detached ones, which run to completion."""
+        for message_type, task, detached in list(self.tasks.values()):
+            if not detached:
+                task.cancel()